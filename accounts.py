@@ -0,0 +1,161 @@
+"""Pool of NotebookLM accounts.
+
+Each account is a storage_state.json in its own NOTEBOOKLM_HOME: the legacy
+NOTEBOOKLM_HOME is the "default" account, further ones live under
+DATA_DIR/accounts/<name>. They come from the admin panel or from
+NOTEBOOKLM_ACCOUNTS ({"name": <storage_state JSON or base64>, ...}).
+
+The job runner spreads jobs across accounts: each creates, uploads or
+finishes at most ACCOUNT_CONCURRENCY jobs at a time (generations waiting on
+NotebookLM don't count) and starts at most ACCOUNT_RATE_PER_HOUR
+generations an hour. An auth or quota error puts the account in cooldown
+for ACCOUNT_COOLDOWN seconds so the rest of the pool carries on.
+"""
+import os
+import re
+import json
+import time
+import base64
+import shutil
+
+import pipeline
+
+ACCOUNTS_DIR = os.path.join(pipeline.DATA_DIR, "accounts")
+ACCOUNT_CONCURRENCY = int(pipeline.get_config("ACCOUNT_CONCURRENCY", "3"))   # jobs working one account at once, not counting generations
+ACCOUNT_RATE_PER_HOUR = int(pipeline.get_config("ACCOUNT_RATE_PER_HOUR", "10"))   # generations started per account per hour; 0 = no limit
+ACCOUNT_COOLDOWN = int(pipeline.get_config("ACCOUNT_COOLDOWN", "1800"))    # seconds an account rests after an auth/quota error
+ACCOUNT_RETRIES = int(pipeline.get_config("ACCOUNT_RETRIES", "3"))   # times one job is requeued for an account error before it fails
+DEFAULT = "default"
+NAME_RE = re.compile(r"^[A-Za-z0-9_-]{1,32}$")
+
+# What notebooklm-py and Google actually say about the account, not any text that mentions a cookie.
+AUTH_ERRORS = re.compile(r"\bAuthError\b|\bauthentication (failed|expired|required)\b|\bnotebooklm login\b|\bnot (logged|signed) in\b"
+                         r"|\b(session|cookies?|credentials) (has |have |are |is )?(expired|invalid)\b|\bunauthori[sz]ed\b|\b(HTTP|status|error)[ :]*40[13]\b", re.I)
+QUOTA_ERRORS = re.compile(r"\bquota\b|\brate.?limit|\btoo many requests\b|\blimit reached\b|\bresource.?exhausted\b|\b(HTTP|status|error)[ :]*429\b", re.I)
+
+
+def home(name):
+    return pipeline.NOTEBOOKLM_HOME if name == DEFAULT else os.path.join(ACCOUNTS_DIR, name)
+
+def storage(name):
+    return os.path.join(home(name), "storage_state.json")
+
+def names():
+    """Accounts that have a storage state on disk."""
+    found = [n for n in (os.listdir(ACCOUNTS_DIR) if os.path.isdir(ACCOUNTS_DIR) else []) if NAME_RE.match(n) and n != DEFAULT and os.path.exists(storage(n))]
+    return ([DEFAULT] if os.path.exists(storage(DEFAULT)) else []) + sorted(found)
+
+def parse_state(raw):
+    """storage_state from JSON text, base64 JSON or an already parsed dict; ValueError otherwise."""
+    if isinstance(raw, dict): return raw
+    try: return json.loads(raw)
+    except json.JSONDecodeError: pass
+    try: return json.loads(base64.b64decode(raw).decode("utf-8"))
+    except Exception: raise ValueError("not a storage_state.json (JSON or base64)")
+
+def add(name, state):
+    """Create or replace an account's storage state; clears any cooldown. Writing the state the
+    account already has is a no-op."""
+    if not NAME_RE.match(name or ""): raise ValueError("Account names are 1-32 letters, digits, _ or -")
+    data = parse_state(state)
+    try:
+        with open(storage(name)) as f:
+            if json.load(f) == data: return
+    except (OSError, ValueError):
+        pass
+    os.makedirs(home(name), exist_ok=True)
+    tmp = storage(name) + ".tmp"
+    with open(tmp, "w") as f: json.dump(data, f)
+    os.replace(tmp, storage(name))
+    clear_cooldown(name)
+
+def remove(name):
+    if name == DEFAULT:
+        if os.path.exists(storage(name)): os.remove(storage(name))
+    else:
+        shutil.rmtree(home(name), ignore_errors=True)
+
+def load_env():
+    """Write NOTEBOOKLM_AUTH_JSON (the default account) and the accounts in NOTEBOOKLM_ACCOUNTS;
+    bad entries are skipped, unchanged ones leave the file (and its age) alone."""
+    raw = pipeline.get_config("NOTEBOOKLM_ACCOUNTS", "")
+    try: accounts = json.loads(raw) if isinstance(raw, str) and raw.strip() else dict(raw or {})
+    except ValueError: accounts = {}
+    auth = pipeline.get_config("NOTEBOOKLM_AUTH_JSON", "")
+    if auth and str(auth).strip(): accounts = {DEFAULT: auth, **accounts}
+    for name, state in accounts.items():
+        try: add(name, state)
+        except (ValueError, OSError): pass
+
+# ─── Cooldown ────────────────────────────────────────────────────────────────
+# Kept in the account dir so the admin panel sees it even when a sidecar runs the jobs.
+def _cooldown_path(name):
+    return os.path.join(home(name), "cooldown.json")
+
+def cooldown(name, reason, seconds=ACCOUNT_COOLDOWN):
+    with open(_cooldown_path(name), "w") as f: json.dump({"until": time.time() + seconds, "reason": reason[:300]}, f)
+
+def clear_cooldown(name):
+    if os.path.exists(_cooldown_path(name)): os.remove(_cooldown_path(name))
+
+def cooling(name):
+    """(seconds left, reason) while an account is in cooldown, else None."""
+    try:
+        with open(_cooldown_path(name)) as f: c = json.load(f)
+    except (OSError, ValueError): return None
+    left = c.get("until", 0) - time.time()
+    return (left, c.get("reason", "")) if left > 0 else None
+
+def classify(err):
+    """"auth" or "quota" when an error message means the account itself is the problem."""
+    if QUOTA_ERRORS.search(err or ""): return "quota"
+    if AUTH_ERRORS.search(err or ""): return "auth"
+    return None
+
+
+class AccountPool:
+    """Chooses an account per job from live load in the job store."""
+
+    def __init__(self, store):
+        self.store = store
+        load_env()
+
+    def load(self):
+        """{account: [jobs holding it, generations started in the last hour]}."""
+        return {n: [0, 0] for n in names()} | {k: list(v) for k, v in self.store.account_load(time.time() - 3600).items()}
+
+    @staticmethod
+    def has_room(name, load):
+        active, started = load.get(name, [0, 0])
+        return (name in names() and not cooling(name) and active < ACCOUNT_CONCURRENCY
+                and (ACCOUNT_RATE_PER_HOUR <= 0 or started < ACCOUNT_RATE_PER_HOUR))
+
+    def pick(self, job, load):
+        """Account for a job about to start, or None if it has to wait. A job that already has a
+        notebook stays on its account; others go to the least busy one. Updates `load`."""
+        if not names(): return DEFAULT   # nothing configured: run and let the CLI report why
+        if job.get("account"):
+            name = job["account"] if self.has_room(job["account"], load) else None
+        else:
+            free = [n for n in names() if self.has_room(n, load)]
+            name = min(free, key=lambda n: tuple(load.get(n, [0, 0]))) if free else None
+        if name: load.setdefault(name, [0, 0])[0] += 1
+        return name
+
+    def penalize(self, name, err):
+        """Cool an account down if `err` is an auth/quota failure -> the kind, else None."""
+        kind = classify(err)
+        if kind and name:
+            cooldown(name, f"{kind}: {err}")
+            if kind == "auth":
+                import nlm_session
+                s = nlm_session.get_session(home(name))
+                if s: s.reset()
+        return kind
+
+
+
+def status(store):
+    """Per-account rows for the admin panel."""
+    load = store.account_load(time.time() - 3600)
+    return [{"account": n, "jobs": load.get(n, (0, 0))[0], "started_1h": load.get(n, (0, 0))[1], "cooldown": cooling(n)} for n in names()]
@@ -1,31 +1,28 @@
 import streamlit as st
-import subprocess
+import io
 import os
-import re
-import tempfile
 import shutil
-import json
 import zipfile
 import time
-import base64
+import uuid
 from datetime import datetime
-from pathlib import Path
+
+from pipeline import get_config, MAX_WORKERS, VIDEO_STYLES, batch_dir, vid_info, poster_path, preview_path, sha256_stream, spool
+from jobs import get_store, get_runner, make_opts, outputs, queue_pdf
+from results import get_cache, RESULT_CACHE_MB
+from metrics import cached_summary as timing_summary
+import janitor
+import accounts
+import health
+from fileserver import file_url, zip_url, start as start_file_server, PUBLIC_FILES_URL
 
 # ─── Page Config ─────────────────────────────────────────────────────────────
 st.set_page_config(page_title="NotebookLM Video Studio", page_icon="🎬", layout="wide", initial_sidebar_state="expanded")
 
 # ─── Config from env / secrets ───────────────────────────────────────────────
-def get_config(key, default=""):
-    """Get config from Streamlit secrets or environment variables."""
-    try:
-        return st.secrets.get(key, os.environ.get(key, default))
-    except:
-        return os.environ.get(key, default)
-
 APP_PASSWORD = get_config("APP_PASSWORD", "")
-NOTEBOOKLM_AUTH_JSON = get_config("NOTEBOOKLM_AUTH_JSON", "")
 ADMIN_PASSWORD = get_config("ADMIN_PASSWORD", "")
-NOTEBOOKLM_HOME = get_config("NOTEBOOKLM_HOME", "/tmp/notebooklm")
+PAGE_SIZE = int(get_config("QUEUE_PAGE_SIZE", "25"))   # queue and download rows rendered per page
 
 # ─── CSS ─────────────────────────────────────────────────────────────────────
 st.markdown("""
@@ -76,149 +73,51 @@ def show_login():
 
 # ─── Auth Setup ──────────────────────────────────────────────────────────────
 def setup_auth():
-    """Ensure NotebookLM auth is configured from env var."""
-    home = NOTEBOOKLM_HOME
-    os.makedirs(home, exist_ok=True)
-    storage_path = os.path.join(home, "storage_state.json")
-
-    # Write auth JSON from env/secrets if file doesn't exist or is empty
-    if NOTEBOOKLM_AUTH_JSON and NOTEBOOKLM_AUTH_JSON.strip():
-        try:
-            auth_data = json.loads(NOTEBOOKLM_AUTH_JSON)
-            with open(storage_path, "w") as f:
-                json.dump(auth_data, f)
-            return True
-        except json.JSONDecodeError:
-            # Maybe it's base64 encoded
-            try:
-                decoded = base64.b64decode(NOTEBOOKLM_AUTH_JSON).decode("utf-8")
-                auth_data = json.loads(decoded)
-                with open(storage_path, "w") as f:
-                    json.dump(auth_data, f)
-                return True
-            except:
-                return False
-    elif os.path.exists(storage_path) and os.path.getsize(storage_path) > 10:
-        return True
-
-    return False
-
-# ─── NLM CLI Wrapper ─────────────────────────────────────────────────────────
-UUID_RE = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.I)
+    """Ensure NotebookLM auth is configured from env vars (see accounts.load_env)."""
+    accounts.load_env()
+    return bool(accounts.names())
+
+# ─── Jobs & Work Dir ─────────────────────────────────────────────────────────
+store = get_store(); get_runner()
+# Links only work where the browser can reach the side port, which only the deployer knows.
+FILES = start_file_server() and bool(PUBLIC_FILES_URL)
+
+def get_batch_id():
+    """One batch per browser session, mirrored in the URL so a refresh re-attaches to it."""
+    if "batch_id" not in st.session_state:
+        st.session_state.batch_id = st.query_params.get("batch") or uuid.uuid4().hex[:12]
+    st.query_params["batch"] = st.session_state.batch_id
+    return st.session_state.batch_id
 
-def get_nlm_env():
-    env = os.environ.copy()
-    env["NOTEBOOKLM_HOME"] = NOTEBOOKLM_HOME
-    return env
+def get_work_dir():
+    return batch_dir(get_batch_id())
 
-def run_nlm(args, timeout=300):
-    try:
-        r = subprocess.run(["notebooklm"] + args, capture_output=True, text=True, timeout=timeout, env=get_nlm_env())
-        return r.returncode == 0, r.stdout.strip(), r.stderr.strip()
-    except FileNotFoundError:
-        return False, "", "notebooklm-py not installed"
-    except subprocess.TimeoutExpired:
-        return False, "", "Command timed out"
-    except Exception as e:
-        return False, "", str(e)
+def read_file(path):
+    with open(path, "rb") as f: return f.read()
 
-def check_installed():
-    ok, _, _ = run_nlm(["--version"], timeout=10); return ok
+def download_link(label, path, filename, key, mime="video/mp4"):
+    """Link streamed from disk by the file server. Without one (no PUBLIC_FILES_URL) a download button
+    whose bytes are read only when it is clicked, so reruns never load videos into memory."""
+    if FILES:
+        st.link_button(label, file_url(path, filename), use_container_width=True)
+    else:
+        st.download_button(label, lambda: read_file(path), filename, mime, key=key, on_click="ignore", use_container_width=True)
 
-def check_auth():
-    ok, _, _ = run_nlm(["list"], timeout=30); return ok
-
-# ─── Video Helpers ───────────────────────────────────────────────────────────
-def get_work_dir():
-    if "work_dir" not in st.session_state:
-        st.session_state.work_dir = tempfile.mkdtemp(prefix="nblm_batch_")
-    return st.session_state.work_dir
+def upload_digest(f):
+    """SHA-256 of an upload, computed once: the uploader hands back the same file_id on every rerun."""
+    memo = st.session_state.setdefault("upload_hashes", {})
+    if f.file_id not in memo: memo[f.file_id] = sha256_stream(f)
+    return memo[f.file_id]
 
 def save_upload(f, name):
+    """Spool an upload into the batch dir in chunks; a no-op on reruns once the same content is there."""
     p = os.path.join(get_work_dir(), name)
-    with open(p, "wb") as fh: fh.write(f.getbuffer())
+    spool(f, p, upload_digest(f))
     return p
 
-def vid_info(path):
-    try:
-        r = subprocess.run(["ffprobe","-v","quiet","-print_format","json","-show_format","-show_streams",path], capture_output=True, text=True, timeout=30)
-        d = json.loads(r.stdout); dur = float(d.get("format",{}).get("duration",0))
-        vs = next((s for s in d.get("streams",[]) if s["codec_type"]=="video"), {})
-        au = next((s for s in d.get("streams",[]) if s["codec_type"]=="audio"), {})
-        fps_s = vs.get("r_frame_rate","0/1")
-        fps = eval(fps_s) if "/" in fps_s else float(fps_s)
-        return {"duration":dur,"duration_str":f"{int(dur//60)}:{int(dur%60):02d}","width":int(vs.get("width",0)),"height":int(vs.get("height",0)),"fps":fps,"has_audio":bool(au),"size_mb":os.path.getsize(path)/(1024*1024)}
-    except:
-        return {"duration":0,"duration_str":"0:00","width":0,"height":0,"fps":0,"has_audio":False,"size_mb":0}
-
-def combine_videos(intro, main, outro, output, res="1920x1080", fps=30):
-    parts, labels = [], []
-    if intro and os.path.exists(intro): parts.append(intro); labels.append("intro")
-    if main and os.path.exists(main): parts.append(main); labels.append("main")
-    if outro and os.path.exists(outro): parts.append(outro); labels.append("outro")
-    if not parts: return False, "No files"
-    if len(parts) == 1: shutil.copy2(parts[0], output); return True, "OK"
-    wd = get_work_dir(); w, h = res.split("x"); norm = []
-    for i, (p, l) in enumerate(zip(parts, labels)):
-        n = os.path.join(wd, f"norm_{l}_{i}_{int(time.time())}.mp4"); info = vid_info(p)
-        if info.get("has_audio"):
-            cmd = ["ffmpeg","-y","-i",p,"-vf",f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2:black,fps={fps}","-c:v","libx264","-preset","fast","-crf","23","-pix_fmt","yuv420p","-c:a","aac","-b:a","192k","-ar","48000","-ac","2",n]
-        else:
-            cmd = ["ffmpeg","-y","-i",p,"-f","lavfi","-i","anullsrc=channel_layout=stereo:sample_rate=48000","-vf",f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2:black,fps={fps}","-c:v","libx264","-preset","fast","-crf","23","-pix_fmt","yuv420p","-c:a","aac","-b:a","192k","-map","0:v:0","-map","1:a:0","-shortest",n]
-        r = subprocess.run(cmd, capture_output=True, text=True, timeout=600)
-        if r.returncode != 0: return False, f"FFmpeg error ({l})"
-        norm.append(n)
-    cf = os.path.join(wd, f"concat_{int(time.time())}.txt")
-    with open(cf, "w") as f:
-        for p in norm: f.write(f"file '{p}'\n")
-    r = subprocess.run(["ffmpeg","-y","-f","concat","-safe","0","-i",cf,"-c","copy",output], capture_output=True, text=True, timeout=600)
-    if r.returncode != 0: return False, "Concat error"
-    return True, "OK"
-
-def process_single_pdf(pdf_path, pdf_name, intro_path, outro_path, style, prompt, res, fps, status_cb):
-    wd = get_work_dir()
-    safe_name = re.sub(r'[^\w\-.]', '_', pdf_name.replace('.pdf', ''))
-
-    status_cb("Creating notebook...")
-    title = pdf_name.replace(".pdf", "").replace("_", " ").title()
-    ok, out, err = run_nlm(["create", title], timeout=60)
-    m = UUID_RE.search(out + "\n" + err)
-    if not m: return False, None, f"Create failed: {err}"
-    nb_id = m.group(0)
-
-    status_cb("Selecting notebook...")
-    run_nlm(["use", nb_id], timeout=30)
-
-    status_cb("Uploading PDF...")
-    ok, out, err = run_nlm(["source", "add", pdf_path], timeout=180)
-    if not ok: return False, None, f"Source add: {err}"
-
-    status_cb("Waiting for processing...")
-    time.sleep(5)
-
-    status_cb("Generating video (3-10 min)...")
-    cmd = ["generate", "video", "--wait"]
-    if style and style != "auto": cmd.extend(["--style", style])
-    if prompt: cmd.append(prompt)
-    ok, out, err = run_nlm(cmd, timeout=900)
-    if not ok: return False, None, f"Generate: {err}"
-
-    status_cb("Downloading video...")
-    raw = os.path.join(wd, f"raw_{safe_name}.mp4")
-    ok, out, err = run_nlm(["download", "video", raw], timeout=300)
-    if not ok or not os.path.exists(raw): return False, None, f"Download: {err}"
-
-    if intro_path or outro_path:
-        status_cb("Adding intro/outro...")
-        final = os.path.join(wd, f"final_{safe_name}.mp4")
-        ok, msg = combine_videos(intro_path, raw, outro_path, final, res, fps)
-        if not ok: return False, None, f"Combine: {msg}"
-        return True, final, ""
-    return True, raw, ""
-
 
 # ─── Session State ───────────────────────────────────────────────────────────
-for k, v in {"queue":[],"intro_file":None,"outro_file":None,"is_installed":None,"is_authenticated":None,"auth_setup":None}.items():
+for k, v in {"intro_file":None,"outro_file":None,"auth_setup":None}.items():
     if k not in st.session_state: st.session_state[k] = v
 
 
@@ -237,11 +136,11 @@ st.markdown('<div class="app-header"><h1>🎬 NotebookLM Video Studio — Batch
 # ─── Sidebar ─────────────────────────────────────────────────────────────────
 with st.sidebar:
     st.markdown("### 🔌 Connection")
-    if st.session_state.is_installed is None: st.session_state.is_installed = check_installed()
-    if st.session_state.is_installed:
+    # Shared across sessions and refreshed in the background; see health.py.
+    is_authenticated = health.installed() and health.connected()
+    if health.installed():
         st.markdown("✅ `notebooklm-py`")
-        if st.session_state.is_authenticated is None: st.session_state.is_authenticated = check_auth()
-        if st.session_state.is_authenticated:
+        if is_authenticated:
             st.markdown('<span class="status-connected">🟢 Connected</span>', unsafe_allow_html=True)
         else:
             st.markdown('<span class="status-disconnected">🔴 Auth expired</span>', unsafe_allow_html=True)
@@ -250,19 +149,21 @@ with st.sidebar:
                 Session expired. Admin needs to update <code>NOTEBOOKLM_AUTH_JSON</code> in secrets.
             </div>
             """, unsafe_allow_html=True)
-            if st.button("🔄 Re-check", key="rc"): st.session_state.is_authenticated = None; st.session_state.auth_setup = None; st.rerun()
+            if st.button("🔄 Re-check", key="rc"): health.invalidate(); st.session_state.auth_setup = None; st.rerun()
     else:
         st.markdown("❌ notebooklm-py not installed on server")
 
     st.divider()
     st.markdown("### ⚙️ Settings")
-    resolution = st.selectbox("Resolution", ["1920x1080 (Full HD)","1280x720 (HD)","3840x2160 (4K)"])
-    target_res = resolution.split(" ")[0]
+    resolutions = st.multiselect("Resolution", ["1920x1080 (Full HD)","1280x720 (HD)","3840x2160 (4K)","854x480 (SD)"], default=["1920x1080 (Full HD)"],
+                                 help="Pick several to get every video in each: one NotebookLM generation, one encode pass.")
+    target_res = [r.split(" ")[0] for r in resolutions] or ["1920x1080"]
     target_fps = st.selectbox("FPS", [24,30,60], index=1)
+    parallel_jobs = st.slider("Parallel jobs", 1, max(1, MAX_WORKERS), min(3, max(1, MAX_WORKERS)), help="PDFs uploaded or encoded at the same time. Generations waiting on NotebookLM don't count; encoding is additionally limited server-wide.")
 
     st.divider()
     st.markdown("### 🎨 Style")
-    video_style = st.selectbox("Visual Style", ["classic","whiteboard","watercolor","retro-print","heritage","paper-craft","kawaii","anime","auto"])
+    video_style = st.selectbox("Visual Style", VIDEO_STYLES)
 
     st.divider()
     st.markdown("### 📝 Prompt")
@@ -273,34 +174,71 @@ with st.sidebar:
     st.markdown("### 🔧 Admin")
     with st.expander("Update Auth (admin only)"):
         admin_pwd = st.text_input("Admin password", type="password", key="admin_pwd")
+        acct_name = st.text_input("Account", value=accounts.DEFAULT, key="acct_name", help="Add more accounts under new names to spread jobs across them.")
         new_auth = st.text_area("Paste storage_state.json content", height=100, key="new_auth")
         if st.button("Update Auth", key="update_auth"):
             if ADMIN_PASSWORD and admin_pwd == ADMIN_PASSWORD:
                 try:
-                    data = json.loads(new_auth)
-                    home = NOTEBOOKLM_HOME
-                    os.makedirs(home, exist_ok=True)
-                    with open(os.path.join(home, "storage_state.json"), "w") as f:
-                        json.dump(data, f)
-                    st.session_state.is_authenticated = None
+                    accounts.add(acct_name.strip(), new_auth)
+                    health.invalidate()
                     st.session_state.auth_setup = None
-                    st.success("✅ Auth updated! Click Re-check.")
-                except:
-                    st.error("Invalid JSON")
+                    st.success("✅ Auth updated!")
+                except ValueError as e:
+                    st.error(f"Invalid: {e}")
             elif not ADMIN_PASSWORD:
                 st.error("Set ADMIN_PASSWORD in secrets first")
             else:
                 st.error("Wrong admin password")
+    with st.expander(f"Accounts ({len(accounts.names())})"):
+        for a in accounts.status(store):
+            cd, h = a["cooldown"], health.auth(a["account"])
+            left = h["expires"] - time.time() if h["expires"] else None
+            st.markdown(f"**{a['account']}** · {a['jobs']} job(s) · {a['started_1h']} started in the last hour"
+                        + (f"  \n⏸️ cooling down {int(cd[0]//60)} min: {cd[1][:80]}" if cd else "")
+                        + ("  \n🟢 signed in" if h["ok"] else f"  \n🔴 {h['problem'] or 'auth check failed'}")
+                        + (f", session expected to last {left/86400:.1f} more day(s)" if left and left > 0 else ""))
+            c1, c2 = st.columns(2)
+            if cd and c1.button("Resume", key=f"acct_resume_{a['account']}"):
+                if ADMIN_PASSWORD and st.session_state.get("admin_pwd") == ADMIN_PASSWORD: accounts.clear_cooldown(a["account"]); st.rerun()
+                else: st.error("Enter the admin password above first")
+            if c2.button("Remove", key=f"acct_rm_{a['account']}"):
+                if ADMIN_PASSWORD and st.session_state.get("admin_pwd") == ADMIN_PASSWORD: accounts.remove(a["account"]); health.invalidate(); st.rerun()
+                else: st.error("Enter the admin password above first")
+        if not accounts.names(): st.caption("No account yet: paste a storage_state.json above")
+    with st.expander("Result cache"):
+        n, used = get_cache().usage()
+        st.caption(f"{n} video(s) | {used/(1024**3):.2f} / {RESULT_CACHE_MB/1024:.1f} GB" if RESULT_CACHE_MB else "Disabled (RESULT_CACHE_MB=0)")
+        if st.button("Clear cache", key="clear_cache", disabled=not n):
+            if ADMIN_PASSWORD and st.session_state.get("admin_pwd") == ADMIN_PASSWORD: get_cache().clear(); st.rerun()
+            else: st.error("Enter the admin password above first")
+    with st.expander("Disk usage"):
+        du = janitor.cached_usage(); gb = lambda b: f"{b/(1024**3):.2f} GB"
+        st.caption(f"{gb(du['total'])} used" + (f" of {gb(du['quota'])} quota" if du["quota"] else "")
+                   + f" | batches {gb(du['batches'])}, results {gb(du['results'])}, segments {gb(du['segments'])}")
+        if du["quota"]: st.progress(min(1.0, du["total"] / du["quota"]))
+        jan = janitor.get()
+        if jan and jan.last: st.caption(f"Last cleanup {datetime.fromtimestamp(jan.last['time']).strftime('%H:%M')}: {jan.last['batches']} batch(es), {jan.last['temp']} temp file(s), {jan.last['results'] + jan.last['segments']} cached file(s)")
+        if jan and st.button("Clean up now", key="janitor_sweep"):
+            if ADMIN_PASSWORD and st.session_state.get("admin_pwd") == ADMIN_PASSWORD: jan.sweep(); st.rerun()
+            else: st.error("Enter the admin password above first")
+    with st.expander("Pipeline timings"):
+        ts = timing_summary()
+        st.caption(f"Last {ts['window']//3600} h | {ts['videos_per_hour']:.1f} videos/hour")
+        if ts["stages"]:
+            st.dataframe([{"stage": k, "n": v["count"], "err": v["errors"], "p50 s": round(v["p50"], 1), "p95 s": round(v["p95"], 1)} for k, v in ts["stages"].items()], hide_index=True, use_container_width=True)
+        else:
+            st.caption("No runs recorded yet")
 
-    q = st.session_state.queue
+    q = store.list(get_batch_id())
     done = sum(1 for i in q if i["status"] == "done")
-    st.caption(f"Queue: {len(q)} | Done: {done}")
+    st.caption(f"Queue: {len(q)} | Done: {done} | Batch: `{get_batch_id()}`")
 
     if st.button("🗑️ Reset", use_container_width=True):
-        wd = st.session_state.get("work_dir")
-        if wd and os.path.exists(wd): shutil.rmtree(wd, ignore_errors=True)
+        store.delete(get_batch_id())
+        shutil.rmtree(get_work_dir(), ignore_errors=True)
         for k in list(st.session_state.keys()):
             if k != "authenticated": del st.session_state[k]
+        st.query_params.clear()
         st.rerun()
 
 
@@ -314,7 +252,7 @@ with ci:
     inf = st.file_uploader("intro", type=["mp4","mov","avi","mkv","webm"], key="int_up", label_visibility="collapsed")
     if inf:
         ip = save_upload(inf, f"intro_{inf.name}"); st.session_state.intro_file = ip
-        st.video(inf); ii = vid_info(ip); st.caption(f"✅ {ii['duration_str']}")
+        st.video(file_url(ip, download=False) if FILES else ip); ii = vid_info(ip); st.caption(f"✅ {ii['duration_str']}")
     elif st.session_state.intro_file:
         st.caption(f"✅ Intro loaded")
 with co:
@@ -322,13 +260,13 @@ with co:
     ouf = st.file_uploader("outro", type=["mp4","mov","avi","mkv","webm"], key="out_up", label_visibility="collapsed")
     if ouf:
         op = save_upload(ouf, f"outro_{ouf.name}"); st.session_state.outro_file = op
-        st.video(ouf); oi = vid_info(op); st.caption(f"✅ {oi['duration_str']}")
+        st.video(file_url(op, download=False) if FILES else op); oi = vid_info(op); st.caption(f"✅ {oi['duration_str']}")
     elif st.session_state.outro_file:
         st.caption(f"✅ Outro loaded")
 with cinfo:
     hi = "✅" if st.session_state.intro_file else "—"
     ho = "✅" if st.session_state.outro_file else "—"
-    st.markdown(f'<div class="info-box">Intro: {hi} | Outro: {ho}<br>Style: {video_style} | {target_res} @ {target_fps}fps</div>', unsafe_allow_html=True)
+    st.markdown(f'<div class="info-box">Intro: {hi} | Outro: {ho}<br>Style: {video_style} | {" + ".join(target_res)} @ {target_fps}fps</div>', unsafe_allow_html=True)
 
 
 # ═══════════════ STEP 2: Upload PDFs ═════════════════════════════════════════
@@ -337,13 +275,8 @@ st.markdown('<div style="display:flex;align-items:center;margin-bottom:1rem;"><s
 
 pdfs = st.file_uploader("Upload PDFs", type=["pdf"], accept_multiple_files=True, key="pdf_batch")
 if pdfs:
-    existing = {i["name"] for i in st.session_state.queue}
-    added = 0
-    for pdf in pdfs:
-        if pdf.name not in existing:
-            pp = save_upload(pdf, pdf.name)
-            st.session_state.queue.append({"name":pdf.name,"path":pp,"status":"pending","output":None,"error":"","nb_id":None})
-            added += 1
+    # Same dedupe (by name, then content) as the CLI and the HTTP API.
+    added = sum(1 for pdf in pdfs if queue_pdf(store, get_batch_id(), pdf.name, pdf, upload_digest(pdf)))
     if added: st.success(f"✅ Added {added} PDF(s)"); st.rerun()
 
 
@@ -351,76 +284,98 @@ if pdfs:
 st.markdown("---")
 st.markdown('<div style="display:flex;align-items:center;margin-bottom:1rem;"><span class="step-badge">3</span><h3 style="margin:0;">Processing Queue</h3></div>', unsafe_allow_html=True)
 
-queue = st.session_state.queue
-if not queue:
-    st.markdown('<div style="text-align:center;color:#9ca3af;padding:2rem;">📂 Empty — upload PDFs above</div>', unsafe_allow_html=True)
-else:
-    total = len(queue)
-    pending = sum(1 for i in queue if i["status"]=="pending")
-    done = sum(1 for i in queue if i["status"]=="done")
-    errors = sum(1 for i in queue if i["status"]=="error")
-    proc = sum(1 for i in queue if i["status"]=="processing")
+def in_flight(i):
+    return i["status"]=="processing" or (i["status"]=="pending" and bool(i["submitted"]))
+
+QUEUE_FILTERS = {"All": lambda i: True, "⏳ Pending": lambda i: i["status"]=="pending" and not i["submitted"], "🔄 Active": in_flight,
+                 "✅ Done": lambda i: i["status"]=="done", "❌ Failed": lambda i: i["status"]=="error"}
+
+def paginate(items, key):
+    """The slice of `items` on the page picked with a pager keyed `key`; only that slice is rendered."""
+    pages = max(1, -(-len(items) // PAGE_SIZE))
+    if pages == 1: return items
+    if st.session_state.get(key, 1) > pages: st.session_state[key] = pages   # the list shrank under the pager
+    page = st.number_input(f"Page (of {pages})", 1, pages, key=key)
+    return items[(page - 1) * PAGE_SIZE:page * PAGE_SIZE]
+
+def queue_counts(queue):
+    """(total, pending, in flight, done, failed)."""
+    return (len(queue), sum(1 for i in queue if QUEUE_FILTERS["⏳ Pending"](i)), sum(1 for i in queue if in_flight(i)),
+            sum(1 for i in queue if i["status"]=="done"), sum(1 for i in queue if i["status"]=="error"))
+
+def queue_view(counts_at_run):
+    """Stats and the current page of the queue. Runs as a fragment: while jobs are in flight only this
+    part re-executes every couple of seconds, and the full page reruns when any count changes (new
+    downloads, Retry/Process buttons, and no more polling once nothing is in flight)."""
+    queue = store.list(get_batch_id())
+    counts = queue_counts(queue)
+    if counts != counts_at_run: st.rerun()
+    total, pending, proc, done, errors = counts
 
     st.markdown(f'<div class="stat-row"><div class="stat-card"><div class="val">{total}</div><div class="lbl">Total</div></div><div class="stat-card"><div class="val">{pending}</div><div class="lbl">⏳ Pending</div></div><div class="stat-card"><div class="val">{proc}</div><div class="lbl">🔄 Active</div></div><div class="stat-card"><div class="val">{done}</div><div class="lbl">✅ Done</div></div><div class="stat-card"><div class="val">{errors}</div><div class="lbl">❌ Failed</div></div></div>', unsafe_allow_html=True)
 
     if total > 0: st.progress(done / total, text=f"{done}/{total}")
 
-    for idx, item in enumerate(queue):
+    shown = st.radio("Show", list(QUEUE_FILTERS), horizontal=True, key="qfilter", label_visibility="collapsed")
+    rows = [i for i in queue if QUEUE_FILTERS[shown](i)]
+    for item in paginate(rows, "qpage"):
         icon = {"pending":"⏳","processing":"🔄","done":"✅","error":"❌"}.get(item["status"],"?")
         cs, cn, ca = st.columns([0.5, 3, 1.5])
         with cs: st.markdown(f"### {icon}")
         with cn:
             st.markdown(f"**{item['name']}**")
             if item["status"]=="done" and item["output"]:
-                vi = vid_info(item["output"]); st.caption(f"✅ {vi['duration_str']} | {vi['size_mb']:.1f} MB")
+                vi = vid_info(item["output"]); took = f" | ⏱️ {int((item['finished'] - item['started']) // 60)} min" if item["started"] and item["finished"] else ""
+                labels = [l for l, _, _ in outputs(item) if l]
+                st.caption(f"✅ {vi['duration_str']} | {vi['size_mb']:.1f} MB{took}" + (f" | {' · '.join(labels)}" if labels else ""))
             elif item["status"]=="error": st.caption(f"❌ {item['error'][:100]}")
+            elif item["status"]=="processing" or item["submitted"]: st.caption(item["stage"] or "Queued...")
             elif item["status"]=="pending": st.caption("Waiting...")
         with ca:
             if item["status"]=="done" and item["output"] and os.path.exists(item["output"]):
-                with open(item["output"],"rb") as f:
-                    st.download_button("⬇️", f.read(), f"{item['name'].replace('.pdf','')}_video.mp4", "video/mp4", key=f"dl_{idx}", use_container_width=True)
+                download_link("⬇️", item["output"], f"{item['name'].replace('.pdf','')}_video.mp4", f"dl_{item['id']}")
             elif item["status"]=="error":
-                if st.button("🔄 Retry", key=f"re_{idx}", use_container_width=True):
-                    st.session_state.queue[idx]["status"]="pending"; st.session_state.queue[idx]["error"]=""; st.rerun()
-            elif item["status"]=="pending":
-                if st.button("🗑️", key=f"rm_{idx}", use_container_width=True):
-                    st.session_state.queue.pop(idx); st.rerun()
+                if st.button("🔄 Retry", key=f"re_{item['id']}", use_container_width=True):
+                    store.update(item["id"], status="pending", error="", attempts=0, submitted=None); st.rerun()
+            elif item["status"]=="pending" and not item["submitted"]:
+                if st.button("🗑️", key=f"rm_{item['id']}", use_container_width=True):
+                    store.delete(get_batch_id(), jid=item["id"]); st.rerun()
+    if not rows: st.caption("Nothing here")
+
+queue = store.list(get_batch_id())
+if not queue:
+    st.markdown('<div style="text-align:center;color:#9ca3af;padding:2rem;">📂 Empty — upload PDFs above</div>', unsafe_allow_html=True)
+else:
+    counts = queue_counts(queue)
+    _, pending, proc, done, _ = counts
+    # The runner works outside this script; poll the job store while anything is in flight.
+    st.fragment(queue_view, run_every=2 if proc else None)(counts)
 
     st.markdown("---")
     b1, b2, b3 = st.columns([2,1,1])
     with b1:
-        if pending > 0 and st.session_state.is_authenticated:
-            if st.button(f"🚀 Process All ({pending} PDFs)", use_container_width=True, type="primary"):
-                bar = st.progress(0, text="Starting..."); cnt = 0
-                for idx, item in enumerate(st.session_state.queue):
-                    if item["status"] != "pending": continue
-                    st.session_state.queue[idx]["status"] = "processing"
-                    bar.progress(cnt/pending, text=f"{cnt+1}/{pending}: {item['name']}")
-                    ist = st.empty(); ilog = st.empty()
-                    def scb(msg): ist.info(f"📄 **{item['name']}** — {msg}")
-                    try:
-                        ok, outp, err = process_single_pdf(item["path"], item["name"], st.session_state.intro_file, st.session_state.outro_file, video_style if video_style!="auto" else None, global_prompt.strip() or None, target_res, target_fps, scb)
-                        if ok:
-                            st.session_state.queue[idx]["status"]="done"; st.session_state.queue[idx]["output"]=outp
-                            ist.success(f"✅ **{item['name']}**")
-                        else:
-                            st.session_state.queue[idx]["status"]="error"; st.session_state.queue[idx]["error"]=err
-                            ist.error(f"❌ **{item['name']}** — {err[:100]}")
-                    except Exception as e:
-                        st.session_state.queue[idx]["status"]="error"; st.session_state.queue[idx]["error"]=str(e)
-                        ist.error(f"❌ {str(e)[:100]}")
-                    cnt += 1
-                bar.progress(1.0, text=f"✅ Done! {cnt} processed"); st.rerun()
+        if pending > 0 and is_authenticated:
+            allowed, risk = health.preflight(pending)
+            if risk: (st.warning if allowed else st.error)(f"⚠️ {risk}")
+            if st.button(f"🚀 Process All ({pending} PDFs)", use_container_width=True, type="primary", disabled=not allowed):
+                try:
+                    ladder = [{"res": r, "fps": target_fps} for r in target_res] if len(target_res) > 1 else None
+                    store.submit(get_batch_id(), make_opts(st.session_state.intro_file, st.session_state.outro_file, video_style, global_prompt, target_res[0], target_fps, parallel_jobs, ladder))
+                    st.rerun()
+                except ValueError as e:
+                    st.error(f"❌ {e}")
         elif pending > 0:
             st.warning("⚠️ NotebookLM not connected")
+        elif proc > 0:
+            st.info("🔄 Processing in the background — safe to close this tab. Reopen this page's URL to check progress.")
     with b2:
         if done > 0:
             if st.button("🗑️ Clear Done", use_container_width=True):
-                st.session_state.queue = [i for i in st.session_state.queue if i["status"]!="done"]; st.rerun()
+                store.delete(get_batch_id(), status="done"); st.rerun()
     with b3:
         if queue:
             if st.button("🗑️ Clear All", use_container_width=True):
-                st.session_state.queue = []; st.rerun()
+                store.delete(get_batch_id()); st.rerun()
 
 
 # ═══════════════ STEP 4: Download ════════════════════════════════════════════
@@ -430,23 +385,36 @@ st.markdown('<div style="display:flex;align-items:center;margin-bottom:1rem;"><s
 done_items = [i for i in queue if i["status"]=="done" and i["output"] and os.path.exists(i["output"])]
 if done_items:
     st.markdown(f"**{len(done_items)} video(s) ready**")
-    for idx, item in enumerate(done_items):
-        with st.expander(f"📺 {item['name'].replace('.pdf','')}"):
-            vi = vid_info(item["output"]); c1,c2 = st.columns([2,1])
-            with c1: st.video(item["output"])
-            with c2:
-                st.metric("Duration", vi["duration_str"]); st.metric("Size", f"{vi['size_mb']:.1f} MB")
-                with open(item["output"],"rb") as f:
-                    st.download_button("⬇️ Download", f.read(), f"{item['name'].replace('.pdf','')}_video.mp4", "video/mp4", key=f"dlp_{idx}", use_container_width=True)
+    for item in paginate(done_items, "dpage"):
+        vi = vid_info(item["output"]); c0, c1, c2, c3 = st.columns([1, 2, 1, 1])
+        poster, small = poster_path(item["output"]), preview_path(item["output"])
+        if os.path.exists(poster): c0.image(file_url(poster, download=False) if FILES else poster, use_container_width=True)
+        c1.markdown(f"📺 **{item['name'].replace('.pdf','')}**  \n{vi['duration_str']} | {vi['size_mb']:.1f} MB")
+        # A player only once asked for: each one fetches its video as soon as it is on the page. It plays
+        # the low-res preview when there is one; the full file is only sent by Download.
+        preview = c2.toggle("▶️ Preview", key=f"pv_{item['id']}")
+        with c3:
+            for label, path, name in outputs(item):
+                download_link(f"⬇️ {label or 'Download'}", path, name, f"dlp_{item['id']}_{label}")
+        if preview:
+            src = small if os.path.exists(small) else item["output"]
+            st.video(file_url(src, download=False) if FILES else src)
     if len(done_items) > 1:
         st.markdown("---")
-        if st.button("📦 Download All as ZIP", use_container_width=True, type="primary"):
-            zp = os.path.join(get_work_dir(), f"videos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip")
-            with zipfile.ZipFile(zp, 'w', zipfile.ZIP_DEFLATED) as zf:
-                for i in done_items: zf.write(i["output"], i["name"].replace(".pdf","_video.mp4"))
-            with open(zp,"rb") as f:
-                mb = sum(vid_info(i["output"])["size_mb"] for i in done_items)
-                st.download_button(f"⬇️ ZIP ({mb:.1f} MB)", f.read(), os.path.basename(zp), "application/zip", key="dlz", use_container_width=True)
+        mb = sum(os.path.getsize(p) for i in done_items for _, p, _ in outputs(i)) / (1024 * 1024)
+        zname = f"videos_{datetime.now().strftime('%Y%m%d_%H%M%S')}.zip"
+        if FILES:
+            # Built on the fly by the file server from the job store: no temp archive, no rebuild per video.
+            st.link_button(f"📦 Download All as ZIP ({mb:.1f} MB)", zip_url(get_batch_id(), zname), use_container_width=True, type="primary")
+        else:
+            def build_zip(items=done_items):
+                """Built only when clicked, on Streamlit's download thread."""
+                buf = io.BytesIO()
+                with zipfile.ZipFile(buf, 'w', zipfile.ZIP_STORED) as zf:
+                    for i in items:
+                        for _, path, name in outputs(i): zf.write(path, name)
+                return buf.getvalue()
+            st.download_button(f"📦 Download All as ZIP ({mb:.1f} MB)", build_zip, zname, "application/zip", key="dlz", on_click="ignore", use_container_width=True, type="primary")
 else:
     st.markdown('<div style="text-align:center;color:#9ca3af;padding:2rem;">No completed videos yet</div>', unsafe_allow_html=True)
 
@@ -0,0 +1,142 @@
+"""Offline pipeline benchmark.
+
+Runs process_single_pdf and combine_videos against bench/fake_notebooklm (no
+Google account needed) over a matrix of batch size, resolution, fps and
+with/without intro/outro, and optionally across COMBINE_MODEs. Each case runs in a fresh interpreter with its own
+DATA_DIR, so caches start cold and peak memory is per case. Writes a JSON
+report: batch latency, videos/hour, per-stage p50/p95 from the span log,
+warm combine time and peak RSS of the process and of the largest ffmpeg.
+
+    python bench/run.py --quick
+    python bench/run.py --sizes 1,4,8 --res 1280x720,1920x1080,3840x2160 --fps 30,60 --out report.json
+    python bench/run.py --quick --intro with --combine concat,filter
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import itertools
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+
+
+def lavfi_clip(path, res, fps, seconds):
+    subprocess.run(["ffmpeg", "-y", "-v", "error", "-f", "lavfi", "-i", f"testsrc2=size={res}:rate={fps}:duration={seconds}",
+                    "-f", "lavfi", "-i", f"sine=frequency=660:sample_rate=48000:duration={seconds}",
+                    "-c:v", "libx264", "-preset", "ultrafast", "-pix_fmt", "yuv420p", "-c:a", "aac", "-shortest", path], check=True)
+    return path
+
+def run_case(case):
+    """Body of one case; runs in the child interpreter started by main()."""
+    sys.path.insert(0, ROOT)
+    import pipeline
+    import metrics
+
+    wd, n = pipeline.batch_dir("bench"), case["size"]
+    intro = outro = None
+    if case["intro"]:
+        intro = lavfi_clip(os.path.join(wd, "intro.mp4"), "1920x1080", 30, 3)
+        outro = lavfi_clip(os.path.join(wd, "outro.mp4"), "1920x1080", 30, 3)
+    pdfs = []
+    for i in range(n):
+        p = os.path.join(wd, f"doc_{i}.pdf")
+        with open(p, "wb") as f: f.write(b"%PDF-1.4\n% bench " + str(i).encode())
+        pdfs.append(p)
+
+    pipeline.COMBINE_MODE = case["combine"]
+
+    def one(p):
+        pipeline.CURRENT_JOB.set(os.path.basename(p))
+        return pipeline.process_single_pdf(p, os.path.basename(p), intro, outro, "classic", "", case["res"], case["fps"], lambda msg: None, wd)
+
+    t0 = time.time()
+    with ThreadPoolExecutor(max_workers=case["jobs"]) as pool: res = list(pool.map(one, pdfs))
+    batch_s = time.time() - t0
+
+    # Combine alone, with the intro/outro segment cache already warm.
+    combine_s = None
+    if intro and res[0][0]:
+        t = time.time()
+        ok, _ = pipeline.combine_videos(intro, pipeline.raw_path(wd, os.path.basename(pdfs[0])), outro, os.path.join(wd, "combine_warm.mp4"), case["res"], case["fps"], mode=case["combine"])
+        combine_s = round(time.time() - t, 3) if ok else None
+
+    stages = {k: {f: round(v[f], 3) for f in ("count", "errors", "p50", "p95", "sum")} for k, v in metrics.summary()["stages"].items()}
+    return {**case, "ok": sum(1 for r in res if r[0]), "errors": [r[2] for r in res if not r[0]],
+            "batch_s": round(batch_s, 3), "videos_per_hour": round(n / batch_s * 3600, 1), "combine_warm_s": combine_s,
+            "stages": stages,
+            # ru_maxrss is KiB on Linux; children = the largest single ffmpeg/ffprobe/CLI process.
+            "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+            "peak_child_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1)}
+
+def spawn(case, args):
+    """Run one case in a child interpreter with an isolated DATA_DIR and the fake CLI on PATH."""
+    tmp = tempfile.mkdtemp(prefix="nblm_bench_")
+    bindir = os.path.join(tmp, "bin"); os.makedirs(bindir)
+    os.symlink(os.path.join(BENCH_DIR, "fake_notebooklm"), os.path.join(bindir, "notebooklm"))
+    env = {**os.environ, "PATH": bindir + os.pathsep + os.environ.get("PATH", ""), "DATA_DIR": os.path.join(tmp, "data"),
+           "NOTEBOOKLM_HOME": os.path.join(tmp, "home"), "NLM_BACKEND": "subprocess", "POLL_INTERVAL": "0.5",
+           "BENCH_STATE": os.path.join(tmp, "state"), "BENCH_GEN_DELAY": str(args.gen_delay), "BENCH_VIDEO_SECONDS": str(args.video_seconds)}
+    try:
+        subprocess.run(["notebooklm", "_prepare"], env=env, check=True)
+        r = subprocess.run([sys.executable, os.path.abspath(__file__), "--case", json.dumps(case)], env=env, capture_output=True, text=True)
+        if r.returncode != 0: return {**case, "ok": 0, "errors": [r.stderr.strip()[-2000:]]}
+        return json.loads(r.stdout.strip().splitlines()[-1])
+    finally:
+        shutil.rmtree(tmp, ignore_errors=True)
+
+def environment():
+    def first_line(cmd):
+        try: return subprocess.run(cmd, capture_output=True, text=True, cwd=ROOT).stdout.splitlines()[0]
+        except (OSError, IndexError): return None
+    return {"time": time.strftime("%Y-%m-%dT%H:%M:%S%z"), "git": first_line(["git", "rev-parse", "HEAD"]),
+            "python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count(),
+            "ffmpeg": first_line(["ffmpeg", "-version"])}
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--sizes", default="1,4", help="batch sizes (comma-separated)")
+    ap.add_argument("--res", default="1280x720,1920x1080,3840x2160")
+    ap.add_argument("--fps", default="30")
+    ap.add_argument("--intro", default="with,without", help="with and/or without intro/outro")
+    ap.add_argument("--combine", default="concat", help="combine modes to compare: concat and/or filter")
+    ap.add_argument("--jobs", type=int, default=4, help="PDFs processed in parallel")
+    ap.add_argument("--gen-delay", type=float, default=2.0, help="seconds the fake NotebookLM takes per video")
+    ap.add_argument("--video-seconds", type=int, default=10, help="length of the fake NotebookLM video")
+    ap.add_argument("--quick", action="store_true", help="one small 720p case per intro setting")
+    ap.add_argument("--out", help="write the JSON report here instead of stdout")
+    ap.add_argument("--case", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.case:
+        print(json.dumps(run_case(json.loads(args.case)))); return
+
+    if args.quick: args.sizes, args.res = "2", "1280x720"
+    matrix = itertools.product([int(x) for x in args.sizes.split(",")], args.res.split(","), [int(x) for x in args.fps.split(",")],
+                               [x.strip() == "with" for x in args.intro.split(",")], args.combine.split(","))
+    cases = []
+    for size, res, fps, intro, combine in matrix:
+        if not intro and combine != args.combine.split(",")[0]: continue   # nothing to combine
+        case = {"size": size, "res": res, "fps": fps, "intro": intro, "combine": combine, "jobs": args.jobs}
+        print(f"▶ {size} × {res}@{fps} {f'with intro/outro ({combine})' if intro else 'without intro/outro'}", file=sys.stderr, flush=True)
+        cases.append(spawn(case, args))
+        c = cases[-1]
+        print(f"  {c.get('ok', 0)}/{size} ok in {c.get('batch_s', '-')} s, {c.get('videos_per_hour', '-')} videos/h, peak ffmpeg {c.get('peak_child_rss_mb', '-')} MB", file=sys.stderr, flush=True)
+
+    report = {"env": environment(), "params": {"gen_delay": args.gen_delay, "video_seconds": args.video_seconds, "jobs": args.jobs}, "cases": cases}
+    if args.out:
+        with open(args.out, "w") as f: json.dump(report, f, indent=2)
+    else:
+        print(json.dumps(report, indent=2))
+    sys.exit(0 if all(c.get("ok") == c["size"] for c in cases) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+"""Streaming file server for finished videos.
+
+st.download_button and st.video(path) both load the whole file into the
+Streamlit process on every rerun. This serves files straight from disk on a
+side port instead: chunked reads, HTTP Range support (seeking, resumable
+downloads) and HMAC-signed, expiring links so only pages rendered for a
+logged-in user can hand them out. Batch ZIPs are streamed on the fly, and
+/metrics exposes pipeline timings for Prometheus.
+
+With API_TOKEN set, /api/ takes batches without a browser (Bearer auth):
+    PUT  /api/batches/<batch>/files/<name>   body = the file; a .pdf is queued, a video
+                                             (intro/outro) is stored for the submit below
+    POST /api/batches/<batch>/submit         JSON {"style", "prompt", "res", "fps", "parallel",
+                                             "intro", "outro", "renditions"}; intro/outro name
+                                             uploaded files, renditions is [{"res", "fps", "crf"}]
+    GET  /api/batches/<batch>                job states, with signed video, preview and poster
+                                             links once done
+"""
+import os
+import re
+import hmac
+import json
+import time
+import base64
+import hashlib
+import secrets
+import threading
+import zipfile
+import mimetypes
+from urllib.parse import quote, unquote, urlparse, parse_qs
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pipeline
+import jobs
+import health
+import metrics
+
+FILES_PORT = int(pipeline.get_config("FILES_PORT", "8502"))
+PUBLIC_FILES_URL = pipeline.get_config("PUBLIC_FILES_URL", "").rstrip("/")   # unset: the UI serves files itself, API links use localhost
+BASE_URL = PUBLIC_FILES_URL or f"http://localhost:{FILES_PORT}"
+# Set FILES_SECRET when links are generated in one process and served by another.
+FILES_SECRET = (pipeline.get_config("FILES_SECRET", "") or secrets.token_hex(32)).encode()
+LINK_TTL = int(pipeline.get_config("FILES_LINK_TTL", str(12 * 3600)))
+CHUNK = 1 << 20
+METRICS_TOKEN = pipeline.get_config("METRICS_TOKEN", "")   # if set, /metrics needs "Authorization: Bearer <token>"
+API_TOKEN = pipeline.get_config("API_TOKEN", "")           # enables /api/ for "Authorization: Bearer <token>"
+BATCH_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+UPLOAD_TYPES = {".pdf", ".mp4", ".mov", ".avi", ".mkv", ".webm"}   # PDFs to queue, intro/outro videos as in the UI
+
+
+def _sign(payload):
+    return base64.urlsafe_b64encode(hmac.new(FILES_SECRET, payload.encode(), hashlib.sha256).digest()[:18]).decode()
+
+def make_token(claims, ttl=LINK_TTL):
+    payload = base64.urlsafe_b64encode(json.dumps({**claims, "e": int(time.time() + ttl)}, separators=(",", ":")).encode()).decode().rstrip("=")
+    return f"{payload}.{_sign(payload)}"
+
+def read_token(token):
+    """Claims of a valid, unexpired token, else None."""
+    try:
+        payload, sig = token.rsplit(".", 1)
+        if not hmac.compare_digest(sig, _sign(payload)): return None
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return claims if claims.get("e", 0) > time.time() else None
+    except Exception:
+        return None
+
+def zip_url(batch, filename):
+    """Signed link to an on-the-fly ZIP of every finished video in a batch."""
+    return f"{BASE_URL}/zip/{make_token({'b': batch})}/{quote(filename)}"
+
+class _Body:
+    """A request body as a read-only stream that ends at Content-Length."""
+    def __init__(self, rfile, length): self.rfile, self.left = rfile, length
+    def seekable(self): return False
+    def read(self, n=-1):
+        n = self.left if n < 0 else min(n, self.left)
+        b = self.rfile.read(n) if n else b""
+        self.left -= len(b)
+        return b
+
+def file_url(path, filename=None, download=True):
+    """Signed link to a file under DATA_DIR. `download=False` serves it inline, e.g. for st.video."""
+    filename = filename or os.path.basename(path)
+    return f"{BASE_URL}/files/{make_token({'p': os.path.abspath(path)})}/{quote(filename)}" + ("?dl=1" if download else "")
+
+
+def job_json(item):
+    """A job as the API returns it: state plus signed links to its video, further renditions,
+    preview and poster."""
+    out = {k: item[k] for k in ("id", "name", "status", "stage", "error")}
+    files = jobs.outputs(item)
+    done = files[0][1] if files else None
+    out["video"] = file_url(done, files[0][2]) if done else None
+    out["renditions"] = {label: file_url(p, name) for label, p, name in files[1:]}
+    for k, fn in (("preview", pipeline.preview_path), ("poster", pipeline.poster_path)):
+        out[k] = file_url(fn(done), download=False) if done and os.path.exists(fn(done)) else None
+    return out
+
+
+class FileHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        url = urlparse(self.path)
+        if url.path == "/metrics": return self.send_metrics(head)
+        if url.path.startswith("/api/"): return self.api("GET", url.path)
+        m = re.match(r"^/(files|zip)/([^/]+)/([^/]+)$", url.path)
+        claims = read_token(m.group(2)) if m else None
+        if not claims: return self.send_error(404)
+        if m.group(1) == "zip":
+            return self.send_zip(claims["b"], m.group(3), head)
+        path = os.path.realpath(claims["p"])
+        if not path.startswith(os.path.realpath(pipeline.DATA_DIR) + os.sep) or not os.path.isfile(path):
+            return self.send_error(404)
+        self.send_file(path, m.group(3), "dl" in parse_qs(url.query), head)
+
+    def do_PUT(self):
+        self.api("PUT", urlparse(self.path).path)
+
+    def do_POST(self):
+        self.api("POST", urlparse(self.path).path)
+
+    def bearer(self, token):
+        return hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {token}")
+
+    def send_json(self, code, obj):
+        body = json.dumps(obj).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.close_connection: self.send_header("Connection", "close")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def api(self, method, path):
+        if not API_TOKEN: return self.send_error(404)
+        if not self.bearer(API_TOKEN): return self.send_error(401)
+        m = re.match(r"^/api/batches/([^/]+)(?:/(submit|files/([^/]+)))?$", path)
+        if not m or not BATCH_RE.match(m.group(1)): return self.send_error(404)
+        batch, store = m.group(1), jobs.get_store()
+        try:
+            if method == "GET" and not m.group(2):
+                items = store.list(batch)
+                if not items: return self.send_error(404)
+                return self.send_json(200, {"batch": batch, "jobs": [job_json(i) for i in items]})
+            if method == "PUT" and m.group(3):
+                length = self.headers.get("Content-Length")
+                if not length: return self.send_error(411)
+                name = os.path.basename(unquote(m.group(3)))
+                if os.path.splitext(name)[1].lower() not in UPLOAD_TYPES or not os.path.splitext(name)[0].strip(". "):
+                    self.close_connection = True   # the body is never read
+                    return self.send_json(400, {"error": f"file names must end in one of {', '.join(sorted(UPLOAD_TYPES))}"})
+                body = _Body(self.rfile, int(length))
+                if name.lower().endswith(".pdf"):
+                    jid = jobs.queue_pdf(store, batch, name, body)
+                    while body.read(CHUNK): pass   # a duplicate is refused before its body is read
+                    return self.send_json(201 if jid else 200, {"id": jid, "queued": bool(jid)})
+                pipeline.spool(body, os.path.join(pipeline.batch_dir(batch), name))
+                return self.send_json(201, {"file": name})
+            if method == "POST" and m.group(2) == "submit":
+                o = json.loads(self.rfile.read(int(self.headers.get("Content-Length") or 0)) or b"{}")
+                if not isinstance(o, dict): raise ValueError("the body must be a JSON object")
+                wd = pipeline.batch_dir(batch)
+                opts = jobs.make_opts(*(os.path.join(wd, os.path.basename(o[k])) if o.get(k) else None for k in ("intro", "outro")),
+                                      o.get("style"), o.get("prompt"), o.get("res", "1920x1080"), o.get("fps", 30), o.get("parallel"), o.get("renditions"))
+                n = sum(1 for i in store.list(batch) if i["status"] == "pending" and not i["submitted"])
+                allowed, warning = health.preflight(n)
+                if not allowed: return self.send_json(409, {"error": warning})
+                store.submit(batch, opts)
+                return self.send_json(202, {"submitted": n, "warning": warning})
+        except (ValueError, TypeError, AttributeError) as e:
+            return self.send_json(400, {"error": str(e)})
+        self.send_error(405)
+
+    def send_metrics(self, head):
+        if METRICS_TOKEN and not self.bearer(METRICS_TOKEN):
+            return self.send_error(401)
+        body = metrics.prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if not head: self.wfile.write(body)
+
+    def send_zip(self, batch, filename, head):
+        """Stream a ZIP_STORED archive straight to the socket: MP4s don't deflate, and nothing is
+        built on disk, so a newly finished video just shows up in the next download."""
+        items = [i for i in jobs.get_store().list(batch) if i["status"] == "done" and i["output"] and os.path.exists(i["output"])]
+        if not items: return self.send_error(404)
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Content-Disposition", f"attachment; filename*=UTF-8''{filename}")
+        # Size isn't known up front; the end of the body is marked by closing the connection.
+        self.send_header("Connection", "close"); self.close_connection = True
+        self.end_headers()
+        if head: return
+        try:
+            with zipfile.ZipFile(self.wfile, "w", zipfile.ZIP_STORED, allowZip64=True) as zf:
+                for i in items:
+                    for _, path, name in jobs.outputs(i): zf.write(path, name)
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    def send_file(self, path, filename, attachment, head):
+        size = os.path.getsize(path)
+        start, end = 0, size - 1
+        rng = re.match(r"^bytes=(\d*)-(\d*)$", self.headers.get("Range", ""))
+        if rng and (rng.group(1) or rng.group(2)):
+            if rng.group(1):
+                start = int(rng.group(1)); end = min(int(rng.group(2)), size - 1) if rng.group(2) else size - 1
+            else:
+                start = max(0, size - int(rng.group(2)))
+            if start > end or start >= size:
+                self.send_response(416); self.send_header("Content-Range", f"bytes */{size}"); self.send_header("Content-Length", "0"); self.end_headers()
+                return
+            self.send_response(206); self.send_header("Content-Range", f"bytes {start}-{end}/{size}")
+        else:
+            self.send_response(200)
+        self.send_header("Content-Type", mimetypes.guess_type(filename)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Content-Disposition", f"{'attachment' if attachment else 'inline'}; filename*=UTF-8''{filename}")
+        self.end_headers()
+        if head: return
+        with open(path, "rb") as f:
+            f.seek(start); left = end - start + 1
+            while left > 0:
+                chunk = f.read(min(CHUNK, left))
+                if not chunk: break
+                try: self.wfile.write(chunk)
+                except (BrokenPipeError, ConnectionResetError): return
+                left -= len(chunk)
+
+
+_server, _lock = None, threading.Lock()
+
+def start():
+    """Start the server once per process. Returns it, or None if the port could not be bound."""
+    global _server
+    with _lock:
+        if _server is None:
+            try:
+                _server = ThreadingHTTPServer(("0.0.0.0", FILES_PORT), FileHandler)
+                _server.daemon_threads = True
+            except OSError:
+                return None
+            threading.Thread(target=_server.serve_forever, name="fileserver", daemon=True).start()
+    return _server
@@ -0,0 +1,129 @@
+"""Shared NotebookLM health checks and session expiry prediction.
+
+`notebooklm --version` and `notebooklm list` are forked once per HEALTH_TTL
+for the whole process rather than once per browser session: fresh results
+come from memory, stale ones are served while a background thread re-checks,
+and concurrent callers of a missing entry wait on the same check. An auth
+result is keyed on the account's storage_state.json mtime, so replacing the
+file re-checks at once.
+
+Cookie `expires` stamps in storage_state.json (the same Google session
+cookies export_auth.py looks for) give each account an expiry, tightened by
+AUTH_MAX_AGE_DAYS from when the state was saved. preflight() compares that
+with a batch's estimated runtime before it is submitted.
+"""
+import os
+import json
+import math
+import time
+import threading
+
+import pipeline
+import accounts
+import metrics
+
+HEALTH_TTL = int(pipeline.get_config("HEALTH_TTL", "300"))                 # seconds a check result is fresh
+AUTH_MAX_AGE_DAYS = float(pipeline.get_config("AUTH_MAX_AGE_DAYS", "14"))  # observed session lifetime; 0 = trust the cookies
+AUTH_EXPIRY_POLICY = pipeline.get_config("AUTH_EXPIRY_POLICY", "warn")     # "warn" or "refuse" batches that outlast the session
+AUTH_COOKIES = {"SID", "HSID", "SSID", "__Secure-1PSID", "__Secure-3PSID"}
+JOB_SECONDS = 600   # per-video estimate until the span log has a few finished jobs
+
+
+class TTLCache:
+    """Values computed at most once per ttl; stale values are refreshed in the background."""
+
+    def __init__(self, ttl):
+        self.ttl, self.lock = ttl, threading.Lock()
+        self.data, self.inflight = {}, {}   # key -> (value, time) / key -> Event
+
+    def get(self, key, fn):
+        with self.lock:
+            hit = self.data.get(key)
+            if hit and time.time() - hit[1] < self.ttl: return hit[0]
+            ev = self.inflight.get(key)
+            owner = ev is None
+            if owner: ev = self.inflight[key] = threading.Event()
+        if hit:
+            if owner: threading.Thread(target=self._refresh, args=(key, fn, ev), daemon=True).start()
+            return hit[0]
+        if owner: self._refresh(key, fn, ev)
+        else: ev.wait()
+        with self.lock: hit = self.data.get(key)
+        return hit[0] if hit else None
+
+    def _refresh(self, key, fn, ev):
+        try: value = fn()
+        except Exception: value = None
+        with self.lock:
+            self.data[key] = (value, time.time())
+            self.inflight.pop(key, None)
+        ev.set()
+
+    def clear(self):
+        with self.lock: self.data.clear()
+
+_cache = TTLCache(HEALTH_TTL)
+
+
+def installed():
+    return bool(_cache.get("installed", pipeline.check_installed))
+
+def _mtime(path):
+    try: return os.path.getmtime(path)
+    except OSError: return None
+
+def session_expiry(name):
+    """(expiry timestamp or None, problem or None) from an account's storage_state.json."""
+    path = accounts.storage(name)
+    try:
+        with open(path) as f: cookies = json.load(f).get("cookies", [])
+    except (OSError, ValueError, AttributeError):
+        return None, "storage_state.json is missing or not JSON"
+    if not cookies: return None, "no cookies, session is invalid"
+    stamps = [c["expires"] for c in cookies if c.get("name") in AUTH_COOKIES and (c.get("expires") or -1) > 0]
+    if not stamps and not AUTH_COOKIES & {c.get("name") for c in cookies}: return None, "missing Google session cookies"
+    expiry = min(stamps) if stamps else None
+    if AUTH_MAX_AGE_DAYS > 0:
+        aged = _mtime(path) + AUTH_MAX_AGE_DAYS * 86400
+        expiry = min(expiry, aged) if expiry else aged
+    return expiry, ("session expired" if expiry and expiry < time.time() else None)
+
+def _check(name):
+    expiry, problem = session_expiry(name)
+    return {"ok": not problem and pipeline.check_auth(accounts.home(name)), "expires": expiry, "problem": problem, "checked": time.time()}
+
+def auth(name):
+    """{"ok", "expires", "problem", "checked"} for one account, from the shared cache."""
+    return _cache.get(("auth", name, _mtime(accounts.storage(name))), lambda: _check(name)) or {"ok": False, "expires": None, "problem": "check failed", "checked": time.time()}
+
+def connected():
+    """Whether any account passes its auth check."""
+    return any(auth(n)["ok"] for n in accounts.names())
+
+def invalidate():
+    _cache.clear()
+
+
+def estimate(n):
+    """Seconds a batch of n videos should take on the accounts that are up now."""
+    up = [a for a in accounts.names() if auth(a)["ok"] and not accounts.cooling(a)] or accounts.names()
+    job = metrics.cached_summary()["stages"].get("job")
+    per_job = job["p50"] if job and job["count"] - job["errors"] >= 3 else JOB_SECONDS
+    slots = max(1, len(up)) * accounts.ACCOUNT_CONCURRENCY
+    secs = math.ceil(n / slots) * per_job
+    if accounts.ACCOUNT_RATE_PER_HOUR > 0:
+        secs = max(secs, (math.ceil(n / (max(1, len(up)) * accounts.ACCOUNT_RATE_PER_HOUR)) - 1) * 3600 + per_job)
+    return secs
+
+def preflight(n):
+    """(allowed, warning or None) for submitting n videos. A batch is at risk when it would still
+    be running after the last healthy account's session is predicted to end."""
+    up = {a: auth(a) for a in accounts.names()}
+    up = {a: h for a, h in up.items() if h["ok"]}
+    if not up: return False, "No NotebookLM account is connected"
+    expiries = [h["expires"] for h in up.values()]
+    if any(e is None for e in expiries): return True, None
+    secs, left = estimate(n), max(expiries) - time.time()
+    if secs <= left: return True, None
+    msg = f"This batch needs about {secs / 3600:.1f} h but the NotebookLM session is expected to expire in {max(0, left) / 3600:.1f} h — refresh auth first"
+    return AUTH_EXPIRY_POLICY != "refuse", msg
@@ -0,0 +1,141 @@
+"""Disk lifecycle for DATA_DIR.
+
+Intermediates are deleted by the pipeline as soon as their stage is done;
+this catches everything else. A background thread periodically removes
+leftover temp/partial files, expires batches nobody has touched for
+BATCH_TTL_HOURS (never one with work in flight) and, when DATA_DIR is over
+DISK_QUOTA_GB, frees space in order of cheapest to recreate: cached
+intro/outro segments (one ffmpeg encode), result cache entries no batch
+links to any more (a NotebookLM generation), then the least recently used
+idle batches.
+"""
+import os
+import re
+import time
+import shutil
+import threading
+
+import pipeline
+import results
+
+DISK_QUOTA_GB = float(pipeline.get_config("DISK_QUOTA_GB", "50"))      # 0 disables quota enforcement
+BATCH_TTL_HOURS = float(pipeline.get_config("BATCH_TTL_HOURS", "72"))  # idle batches older than this are deleted
+JANITOR_INTERVAL = int(pipeline.get_config("JANITOR_INTERVAL", "600"))
+BATCHES_DIR = os.path.join(pipeline.DATA_DIR, "batches")
+TEMP_RE = re.compile(r"(\.tmp(\.mp4)?|\.part\.mp4|\.zip|^concat_.*\.txt|^norm_main_.*\.mp4)$")
+TEMP_AGE = 3600   # leftovers older than this belong to no running step
+USAGE_TTL = 120   # seconds the admin panel reuses one walk of DATA_DIR
+_usage, _usage_lock = None, threading.Lock()
+
+
+def dir_bytes(path):
+    """Bytes on disk under path; hardlinked files (result cache <-> batch outputs) count once."""
+    total, seen = 0, set()
+    for root, _, files in os.walk(path):
+        for f in files:
+            try: st = os.stat(os.path.join(root, f))
+            except OSError: continue
+            if (st.st_dev, st.st_ino) not in seen: seen.add((st.st_dev, st.st_ino)); total += st.st_size
+    return total
+
+def usage():
+    """Bytes per area of DATA_DIR plus the quota, for the admin panel."""
+    areas = {"batches": dir_bytes(BATCHES_DIR), "segments": dir_bytes(pipeline.SEGMENT_CACHE_DIR), "results": dir_bytes(results.RESULTS_DIR)}
+    total = dir_bytes(pipeline.DATA_DIR)
+    return {**areas, "other": max(0, total - sum(areas.values())), "total": total, "quota": int(DISK_QUOTA_GB * 1024 ** 3)}
+
+def cached_usage():
+    """usage() shared by every session for USAGE_TTL seconds; a sweep invalidates it."""
+    global _usage
+    with _usage_lock:
+        if not _usage or time.time() - _usage[1] >= USAGE_TTL: _usage = (usage(), time.time())
+        return _usage[0]
+
+
+class Janitor:
+    def __init__(self, store, interval=JANITOR_INTERVAL):
+        self.store, self.interval = store, interval
+        self.lock = threading.Lock()
+        self.last = None   # summary of the most recent sweep
+        threading.Thread(target=self._loop, name="janitor", daemon=True).start()
+
+    def _loop(self):
+        while True:
+            try: self.sweep()
+            except Exception: pass
+            time.sleep(self.interval)
+
+    def batches(self):
+        """[(batch id, last activity, busy)] for every batch dir, least recently used first."""
+        out = []
+        for b in os.listdir(BATCHES_DIR) if os.path.isdir(BATCHES_DIR) else []:
+            d = os.path.join(BATCHES_DIR, b)
+            rows = self.store.list(b)
+            busy = any(r["status"] == "processing" or (r["status"] == "pending" and r["submitted"]) for r in rows)
+            stamps = [t for r in rows for t in (r["created"], r["submitted"], r["finished"]) if t]
+            try: stamps.append(os.path.getmtime(d))
+            except OSError: continue
+            out.append((b, max(stamps), busy))
+        return sorted(out, key=lambda x: x[1])
+
+    def drop_batch(self, batch):
+        self.store.delete(batch)
+        shutil.rmtree(os.path.join(BATCHES_DIR, batch), ignore_errors=True)
+
+    def sweep(self):
+        """One pass: stale temp files, expired batches, then the quota. Returns what was removed."""
+        global _usage
+        with self.lock:
+            now, stats = time.time(), {"temp": 0, "batches": 0, "results": 0, "segments": 0}
+            for root, _, files in os.walk(pipeline.DATA_DIR):
+                for f in files:
+                    p = os.path.join(root, f)
+                    try:
+                        if TEMP_RE.search(f) and now - os.path.getmtime(p) > TEMP_AGE: os.remove(p); stats["temp"] += 1
+                    except OSError: pass
+            if BATCH_TTL_HOURS > 0:
+                for b, last, busy in self.batches():
+                    if not busy and now - last > BATCH_TTL_HOURS * 3600: self.drop_batch(b); stats["batches"] += 1
+            if DISK_QUOTA_GB > 0: self._enforce_quota(stats)
+            _usage, self.last = None, {**stats, "time": now}
+            return self.last
+
+    def _enforce_quota(self, stats):
+        quota = DISK_QUOTA_GB * 1024 ** 3
+        over = dir_bytes(pipeline.DATA_DIR) - quota
+        if over <= 0: return
+        # Segments are touched on every reuse, so mtime order is least recently used first. Recently
+        # used ones may be in an encode right now and are kept.
+        segs = [os.path.join(pipeline.SEGMENT_CACHE_DIR, f) for f in os.listdir(pipeline.SEGMENT_CACHE_DIR)] if os.path.isdir(pipeline.SEGMENT_CACHE_DIR) else []
+        for p in sorted(segs, key=lambda p: os.path.getmtime(p) if os.path.exists(p) else 0):
+            if over <= 0: return
+            try:
+                if time.time() - os.path.getmtime(p) < TEMP_AGE: continue
+                size = os.path.getsize(p); os.remove(p); over -= size; stats["segments"] += 1
+            except OSError: pass
+        for key, size, _ in sorted(results.get_cache().entries(), key=lambda x: x[2]):
+            if over <= 0: return
+            # Still linked from a batch output: dropping the entry frees nothing yet.
+            try:
+                if os.stat(os.path.join(results.RESULTS_DIR, key, results.VIDEO)).st_nlink > 1: continue
+            except OSError: pass
+            shutil.rmtree(os.path.join(results.RESULTS_DIR, key), ignore_errors=True); stats["results"] += 1
+            over -= size
+        for b, _, busy in self.batches():
+            if over <= 0: return
+            if busy: continue
+            over -= dir_bytes(os.path.join(BATCHES_DIR, b)); self.drop_batch(b); stats["batches"] += 1
+
+
+_janitor, _lock = None, threading.Lock()
+
+def start(store):
+    """Start the process-wide janitor once; the job runner does this, so it runs wherever jobs run."""
+    global _janitor
+    with _lock:
+        if _janitor is None: _janitor = Janitor(store)
+    return _janitor
+
+def get():
+    """The running janitor, or None in a process that doesn't run jobs."""
+    return _janitor
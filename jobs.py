@@ -0,0 +1,395 @@
+"""Durable background job engine.
+
+Jobs live in a SQLite table under DATA_DIR, so a browser refresh, a dropped
+websocket or a container restart does not lose a batch. The Streamlit UI only
+writes submissions and polls rows; a JobRunner (in-process by default, or a
+sidecar started with `python jobs.py`) owns execution.
+"""
+import os
+import re
+import json
+import time
+import uuid
+import asyncio
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pipeline
+import results
+import janitor
+import accounts
+
+DB_PATH = os.path.join(pipeline.DATA_DIR, "jobs.db")
+JOB_RUNNER = pipeline.get_config("JOB_RUNNER", "inprocess")   # "inprocess" or "external" (sidecar owns the queue)
+HEARTBEAT = 10          # seconds between a runner's liveness stamps
+RUNNER_STALE = 60       # a runner silent this long is dead and its jobs are recovered
+
+COLUMNS = ["id", "batch", "name", "path", "status", "stage", "nb_id", "task_id", "phase", "gen_started", "account", "attempts", "runner", "output", "error", "opts", "submitted", "created", "started", "finished"]
+
+
+class JobStore:
+    """Thin SQLite wrapper. One short-lived connection per call keeps it safe across threads."""
+
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._conn() as c:
+            c.execute("PRAGMA journal_mode=WAL")
+            c.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, batch TEXT NOT NULL, name TEXT NOT NULL, path TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending', stage TEXT DEFAULT '', nb_id TEXT, task_id TEXT, phase TEXT, gen_started REAL, account TEXT, attempts INTEGER DEFAULT 0, runner TEXT, output TEXT,
+                error TEXT DEFAULT '', opts TEXT DEFAULT '{}', submitted REAL, created REAL, started REAL, finished REAL)""")
+            c.execute("CREATE INDEX IF NOT EXISTS jobs_batch ON jobs(batch)")
+            c.execute("CREATE TABLE IF NOT EXISTS runners (id TEXT PRIMARY KEY, beat REAL)")
+            have = {r[1] for r in c.execute("PRAGMA table_info(jobs)")}
+            for col, typ in (("task_id", "TEXT"), ("phase", "TEXT"), ("gen_started", "REAL"), ("account", "TEXT"), ("attempts", "INTEGER DEFAULT 0"), ("runner", "TEXT")):
+                if col not in have: c.execute(f"ALTER TABLE jobs ADD COLUMN {col} {typ}")
+
+    def _conn(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _rows(self, sql, args=()):
+        with self._conn() as c:
+            c.row_factory = sqlite3.Row
+            return [self._item(r) for r in c.execute(sql, args).fetchall()]
+
+    @staticmethod
+    def _item(row):
+        d = dict(row); d["opts"] = json.loads(d.get("opts") or "{}")
+        return d
+
+    def add(self, batch, name, path):
+        jid = uuid.uuid4().hex
+        with self._conn() as c:
+            c.execute("INSERT INTO jobs (id, batch, name, path, created) VALUES (?,?,?,?,?)", (jid, batch, name, path, time.time()))
+        return jid
+
+    def get(self, jid):
+        rows = self._rows("SELECT * FROM jobs WHERE id=?", (jid,))
+        return rows[0] if rows else None
+
+    def list(self, batch):
+        return self._rows("SELECT * FROM jobs WHERE batch=? ORDER BY created", (batch,))
+
+    def update(self, jid, **fields):
+        if "opts" in fields: fields["opts"] = json.dumps(fields["opts"])
+        with self._conn() as c:
+            c.execute(f"UPDATE jobs SET {', '.join(f'{k}=?' for k in fields)} WHERE id=?", (*fields.values(), jid))
+
+    def delete(self, batch, status=None, jid=None):
+        sql, args = "DELETE FROM jobs WHERE batch=?", [batch]
+        if status: sql += " AND status=?"; args.append(status)
+        if jid: sql += " AND id=?"; args.append(jid)
+        with self._conn() as c: c.execute(sql, args)
+
+    def submit(self, batch, opts):
+        """Hand every pending job of a batch to the runner with the given processing options."""
+        with self._conn() as c:
+            c.execute("UPDATE jobs SET opts=?, submitted=?, stage='Queued...' WHERE batch=? AND status='pending'", (json.dumps(opts), time.time(), batch))
+
+    def claim(self, jid, runner=None):
+        """Atomically move a submitted job to processing for `runner`; False if another runner got it first."""
+        with self._conn() as c:
+            return c.execute("UPDATE jobs SET status='processing', phase='', task_id=NULL, started=?, runner=? WHERE id=? AND status='pending' AND submitted IS NOT NULL", (time.time(), runner, jid)).rowcount == 1
+
+    def advance(self, jid, phase, to, runner=None):
+        """Atomically move a processing job from one phase to the next (now held by `runner`); False if it already moved."""
+        with self._conn() as c:
+            return c.execute("UPDATE jobs SET phase=?, runner=? WHERE id=? AND status='processing' AND phase=?", (to, runner, jid, phase)).rowcount == 1
+
+    def runnable(self):
+        return self._rows("SELECT * FROM jobs WHERE status='pending' AND submitted IS NOT NULL ORDER BY submitted, created")
+
+    def account_load(self, since):
+        """{account: (jobs processing outside generation, generations started after `since`)}.
+        Generations waiting on NotebookLM only count against the hourly rate."""
+        with self._conn() as c:
+            rows = c.execute("""SELECT account, SUM(status='processing' AND COALESCE(phase, '')!='generating'), SUM(COALESCE(gen_started, 0) > ?)
+                                FROM jobs WHERE account IS NOT NULL GROUP BY account""", (since,)).fetchall()
+        return {a: (n or 0, s or 0) for a, n, s in rows}
+
+    def status_counts(self):
+        with self._conn() as c:
+            return dict(c.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+
+    def generating(self):
+        return self._rows("SELECT * FROM jobs WHERE status='processing' AND phase='generating'")
+
+    def active_counts(self):
+        """Jobs holding a worker per batch. Generations waiting on NotebookLM don't count."""
+        with self._conn() as c:
+            return dict(c.execute("SELECT batch, COUNT(*) FROM jobs WHERE status='processing' AND COALESCE(phase, '')!='generating' GROUP BY batch").fetchall())
+
+    def beat(self, runner):
+        """Stamp a runner as alive; forget runners gone for a day."""
+        now = time.time()
+        with self._conn() as c:
+            c.execute("INSERT OR REPLACE INTO runners (id, beat) VALUES (?,?)", (runner, now))
+            c.execute("DELETE FROM runners WHERE beat < ?", (now - 86400,))
+
+    def requeue_interrupted(self):
+        """Recover jobs left 'processing' by a runner that stopped beating, never those another live
+        runner (the UI's, a sidecar, a CLI batch) is working on. Those with a generation task go back
+        to the poller; the rest return to the queue with their nb_id kept so they resume."""
+        dead = "status='processing' AND (runner IS NULL OR runner NOT IN (SELECT id FROM runners WHERE beat > ?))"
+        with self._conn() as c:
+            cutoff = time.time() - RUNNER_STALE
+            c.execute(f"UPDATE jobs SET phase='generating', runner=NULL WHERE {dead} AND task_id IS NOT NULL AND phase!='generating'", (cutoff,))
+            return c.execute(f"UPDATE jobs SET status='pending', runner=NULL, stage='Resuming after restart...' WHERE {dead} AND task_id IS NULL", (cutoff,)).rowcount
+
+
+class JobRunner:
+    """Runs submitted jobs in two phases. Pool workers create the notebook, upload the PDF and
+    start generation, then let go; one asyncio poller watches every pending generation at once
+    and hands finished ones back to the pool for download and intro/outro.
+
+    Several runners can share one store: claims are atomic, and each stamps a heartbeat so that
+    only the jobs of a runner that died are recovered. `batch` limits a runner to one batch (the
+    CLI's, which exits when that batch is done)."""
+
+    def __init__(self, store, max_workers=pipeline.MAX_WORKERS, poll=1.0, batch=None):
+        self.store, self.poll, self.batch = store, poll, batch
+        self.id, self.beat = uuid.uuid4().hex, 0
+        self.max_workers = max(1, max_workers)
+        self.pool = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="job")
+        self.running = set()
+        self.lock = threading.Lock()
+        self._heartbeat()
+        janitor.start(store)
+        self.accounts = accounts.AccountPool(store)
+        threading.Thread(target=self._loop, name="job-dispatcher", daemon=True).start()
+        threading.Thread(target=lambda: asyncio.run(self._poller()), name="job-poller", daemon=True).start()
+
+    def _heartbeat(self):
+        """Stamp this runner alive and recover the jobs of dead ones, every HEARTBEAT seconds."""
+        if time.time() - self.beat < HEARTBEAT: return
+        self.store.beat(self.id); self.store.requeue_interrupted()
+        self.beat = time.time()
+
+    def _loop(self):
+        while True:
+            try: self._heartbeat(); self._dispatch()
+            except Exception: pass
+            time.sleep(self.poll)
+
+    def _dispatch(self):
+        active, load = self.store.active_counts(), self.accounts.load()
+        for job in self.store.runnable():
+            if self.batch and job["batch"] != self.batch: continue
+            with self.lock:
+                if len(self.running) >= self.max_workers: return
+            # Per-batch cap from the UI's "Parallel jobs" slider.
+            if active.get(job["batch"], 0) >= int(job["opts"].get("parallel", self.max_workers)): continue
+            # Per-account concurrency, hourly rate and cooldown.
+            acct = self.accounts.pick(job, load)
+            if not acct: continue
+            if not self.store.claim(job["id"], self.id): continue
+            self.store.update(job["id"], account=acct)
+            active[job["batch"]] = active.get(job["batch"], 0) + 1
+            self._submit(self._start, {**job, "account": acct})
+
+    def _submit(self, fn, job):
+        with self.lock: self.running.add(job["id"])
+        self.pool.submit(self._guarded, fn, job)
+
+    def _guarded(self, fn, job):
+        token = pipeline.CURRENT_JOB.set(job["id"])   # tags every span this step records
+        home = pipeline.NLM_HOME.set(accounts.home(job["account"]) if job.get("account") else None)
+        try: fn(job)
+        except Exception as e: self._fail(job["id"], str(e))
+        finally:
+            pipeline.NLM_HOME.reset(home)
+            pipeline.CURRENT_JOB.reset(token)
+            with self.lock: self.running.discard(job["id"])
+
+    def _done(self, jid, ok, **fields):
+        """Final status update, plus a whole-job span from claim to finish."""
+        now, job = time.time(), self.store.get(jid)
+        self.store.update(jid, status="done" if ok else "error", phase="", finished=now, **fields)
+        if job and job["started"]:
+            pipeline.log_interval("job", job["started"], now, ok, job=jid)
+
+    def _fail(self, jid, err):
+        self._done(jid, False, error=err)
+
+    def _account_error(self, job, err, keep=False):
+        """On an auth/quota error, cool the account down and requeue the job instead of failing it,
+        up to ACCOUNT_RETRIES times. `keep` leaves it on its account (its notebook already holds the
+        video). True if requeued."""
+        acct = job.get("account")
+        kind = self.accounts.penalize(acct, err) if acct in accounts.names() else None
+        attempts = (self.store.get(job["id"]) or job).get("attempts") or 0
+        if not kind or attempts >= accounts.ACCOUNT_RETRIES: return False
+        fields = {} if keep else {"account": None, "nb_id": None, "task_id": None}
+        self.store.update(job["id"], status="pending", phase="", attempts=attempts + 1, stage=f"⏸️ Account {acct} hit a {kind} error, waiting for an account...", **fields)
+        return True
+
+    def _stage(self, jid):
+        return lambda msg: self.store.update(jid, stage=msg)
+
+    @staticmethod
+    def _keys(job):
+        """Result cache keys (raw, final) for a job; (None, None) if an input has gone missing."""
+        o = job["opts"]
+        try:
+            g = results.gen_key(job["path"], o.get("style"), o.get("prompt"))
+            return g, results.final_key(g, o.get("intro"), o.get("outro"), o.get("res", "1920x1080"), o.get("fps", 30), o.get("renditions"))
+        except OSError:
+            return None, None
+
+    def _start(self, job):
+        jid, o, wd = job["id"], job["opts"], os.path.dirname(job["path"])
+        raw = pipeline.raw_path(wd, job["name"])
+        if job["submitted"]: pipeline.log_interval("queued", job["submitted"])
+        cache, (gkey, fkey) = results.get_cache(), self._keys(job)
+        hit = cache.get(fkey)
+        if hit:
+            out = pipeline.final_path(wd, job["name"])
+            results.link_video(hit[0], out, o.get("renditions"))
+            return self._done(jid, True, nb_id=hit[1].get("nb_id"), output=out, stage="")
+        hit = cache.get(gkey)
+        if hit and not os.path.exists(raw):
+            # Same PDF, style and prompt as an earlier job: skip NotebookLM entirely.
+            results.link_video(hit[0], raw)
+            job = {**job, "nb_id": hit[1].get("nb_id")}
+            self.store.update(jid, nb_id=job["nb_id"], stage="Reusing cached video...")
+        if job["nb_id"] and not os.path.exists(raw):
+            # A resumed notebook may already hold the finished video from before the restart.
+            self.store.update(jid, stage="Resuming notebook...")
+            pipeline.download_video(job["nb_id"], raw)
+        if os.path.exists(raw): return self._finish(job)
+        ok, ids, err = pipeline.start_generation(
+            job["path"], job["name"], o.get("style"), o.get("prompt"), self._stage(jid),
+            nb_id=job["nb_id"], on_nb_id=lambda nb: self.store.update(jid, nb_id=nb))
+        if not ok: return self._account_error(job, err) or self._fail(jid, err)
+        self.store.update(jid, nb_id=ids[0], task_id=ids[1], phase="generating", gen_started=time.time(), stage="Generating video (3-10 min)...")
+
+    def _finish(self, job):
+        jid, o = job["id"], job["opts"]
+        ok, outp, err = pipeline.finish_video(
+            job["name"], job["nb_id"], job["task_id"], o.get("intro"), o.get("outro"),
+            o.get("res", "1920x1080"), o.get("fps", 30), self._stage(jid), os.path.dirname(job["path"]), o.get("renditions"))
+        if not ok: return self._account_error(job, err, keep=True) or self._fail(jid, err)
+        gkey, fkey = self._keys(job)
+        raw = pipeline.raw_path(os.path.dirname(job["path"]), job["name"])
+        results.get_cache().put(gkey, raw, nb_id=job["nb_id"], name=job["name"])
+        if fkey: results.get_cache().put(fkey, outp, o.get("renditions"), nb_id=job["nb_id"], name=job["name"])
+        # The raw download is only an intermediate once the final cut exists (the cache keeps its own link).
+        if outp != raw and os.path.exists(raw): os.remove(raw); pipeline.drop_proxies(raw)
+        self._done(jid, True, output=outp, stage="")
+
+    @staticmethod
+    def _poll(job):
+        pipeline.CURRENT_JOB.set(job["id"])   # runs in a fresh copy of the poller's context
+        pipeline.NLM_HOME.set(accounts.home(job["account"]) if job["account"] else None)
+        return pipeline.poll_generation(job["nb_id"], job["task_id"])
+
+    async def _poller(self):
+        """Check all generating jobs concurrently, each on its own backoff schedule."""
+        sched = {}  # job id -> [next check, interval]
+        while True:
+            try:
+                now, gen = time.time(), [j for j in self.store.generating() if not self.batch or j["batch"] == self.batch]
+                for jid in set(sched) - {j["id"] for j in gen}: del sched[jid]
+                due = [j for j in gen if sched.setdefault(j["id"], [now + pipeline.POLL_INTERVAL, pipeline.POLL_INTERVAL])[0] <= now]
+                polled = await asyncio.gather(*(asyncio.to_thread(self._poll, j) for j in due), return_exceptions=True)
+                for job, res in zip(due, polled):
+                    status, err = res if isinstance(res, tuple) else ("unknown", str(res))
+                    if status == "completed":
+                        if self.store.advance(job["id"], "generating", "finishing", self.id):
+                            pipeline.log_interval("generate", job["gen_started"] or now, now, job=job["id"])
+                            self._submit(self._finish, job)
+                    elif status in ("failed", "not_found"):
+                        pipeline.log_interval("generate", job["gen_started"] or now, now, False, job=job["id"])
+                        self._account_error(job, err) or self._fail(job["id"], f"Generate: {err or status}")
+                    elif now - (job["gen_started"] or now) > pipeline.GENERATE_TIMEOUT:
+                        self._fail(job["id"], "Generate: timed out")
+                    else:
+                        s = sched[job["id"]]; s[1] = min(s[1] * 1.5, pipeline.POLL_MAX_INTERVAL); s[0] = now + s[1]
+            except Exception:
+                pass
+            await asyncio.sleep(self.poll * 5)
+
+
+# ─── Submission helpers (UI, CLI and HTTP API) ───────────────────────────────
+def make_opts(intro=None, outro=None, style=None, prompt=None, res="1920x1080", fps=30, parallel=None, renditions=None):
+    """Validated processing options for JobStore.submit; ValueError on bad input. `renditions`
+    ([{"res", "fps", "crf"}], fps/crf optional) asks for several outputs per video; the highest
+    becomes res/fps and the job's main output."""
+    if style and style not in pipeline.VIDEO_STYLES: raise ValueError(f"style must be one of {', '.join(pipeline.VIDEO_STYLES)}")
+    if renditions is not None and (not isinstance(renditions, list) or not renditions or not all(isinstance(r, dict) for r in renditions)):
+        raise ValueError('renditions must be a list like [{"res": "1920x1080"}, {"res": "1280x720", "fps": 30, "crf": 23}]')
+    fps, ladder = _whole(fps, "fps", 1, 120), {}
+    for r in renditions or [{"res": res, "fps": fps}]:
+        if not isinstance(r.get("res"), str) or not re.match(r"^\d{2,4}x\d{2,4}$", r["res"]): raise ValueError("res must look like 1920x1080")
+        crf = _whole(r["crf"], "crf", 0, 51) if r.get("crf") is not None else None
+        r = {"res": r["res"], "fps": _whole(r.get("fps") or fps, "fps", 1, 120), **({"crf": crf} if crf is not None else {})}
+        ladder[(r["res"], r["fps"])] = r
+    ladder = sorted(ladder.values(), key=lambda r: (int(r["res"].split("x")[1]), r["fps"]), reverse=True)
+    labels = [pipeline.rendition_label(r, ladder[0]["fps"]) for r in ladder]
+    dup = next((l for l in labels if labels.count(l) > 1), None)
+    # Files are named after height and fps, so two widths at one height would overwrite each other.
+    if dup: raise ValueError(f"two renditions would both be {dup}; use one size per height and frame rate")
+    for p in (intro, outro):
+        if p and not os.path.isfile(p): raise ValueError(f"not a file: {p}")
+    return {"intro": intro, "outro": outro, "style": None if style in (None, "auto") else style, "prompt": (prompt or "").strip() or None,
+            "res": ladder[0]["res"], "fps": ladder[0]["fps"], "renditions": ladder if len(ladder) > 1 else None,
+            "parallel": _whole(parallel or pipeline.MAX_WORKERS, "parallel", 1, 1000)}
+
+def _whole(v, name, lo, hi):
+    """int(v) within lo..hi, else a ValueError a user can act on."""
+    try: v = int(v)
+    except (TypeError, ValueError): raise ValueError(f"{name} must be a whole number") from None
+    if not lo <= v <= hi: raise ValueError(f"{name} must be between {lo} and {hi}")
+    return v
+
+def outputs(item):
+    """[(label, path, download name)] of a finished job that are on disk: the main output first,
+    then its further renditions."""
+    if item["status"] != "done" or not item["output"]: return []
+    stem, rs = item["name"].replace(".pdf", ""), item["opts"].get("renditions") or []
+    files = [(pipeline.rendition_label(rs[0], rs[0]["fps"]) if rs else "", item["output"], f"{stem}_video.mp4")]
+    for r in rs[1:]:
+        label = pipeline.rendition_label(r, rs[0]["fps"])
+        files.append((label, pipeline.rendition_path(item["output"], r, rs[0]["fps"]), f"{stem}_video_{label}.mp4"))
+    return [f for f in files if os.path.exists(f[1])]
+
+def queue_pdf(store, batch, name, f, digest=None):
+    """Spool a PDF (file object) into a batch and queue it -> job id, or None if the batch already
+    has a PDF of that name or content. A known `digest` lets a duplicate be refused unread; without
+    one (a stream) the hash is taken while spooling."""
+    name = os.path.basename(name)
+    queued = store.list(batch)
+    if not name or any(i["name"] == name for i in queued): return None
+    same = lambda d: any(os.path.exists(i["path"]) and pipeline.file_sha256(i["path"]) == d for i in queued)
+    if digest and same(digest): return None
+    dst = os.path.join(pipeline.batch_dir(batch), name)
+    got = pipeline.spool(f, dst, digest)
+    if not digest and same(got): os.remove(dst); return None
+    return store.add(batch, name, dst)
+
+
+_store, _runner, _init_lock = None, None, threading.Lock()
+
+def get_store():
+    global _store
+    with _init_lock:
+        if _store is None: _store = JobStore()
+    return _store
+
+def get_runner():
+    """Start the process-wide runner once; None when an external sidecar owns the queue."""
+    global _runner
+    if JOB_RUNNER != "inprocess": return None
+    store = get_store()
+    with _init_lock:
+        if _runner is None: _runner = JobRunner(store)
+    return _runner
+
+
+if __name__ == "__main__":
+    # Sidecar mode: run with JOB_RUNNER=external on the Streamlit side.
+    JobRunner(get_store())
+    print(f"Job runner up ({pipeline.MAX_WORKERS} workers), db: {DB_PATH}")
+    while True: time.sleep(3600)
@@ -0,0 +1,86 @@
+"""Aggregates over the pipeline's timing spans.
+
+pipeline.span() appends one JSON line per stage to DATA_DIR/spans.jsonl. This
+reads the recent part of that log back and reduces it to per-stage counts,
+error counts and p50/p95 durations plus videos finished per hour, for the
+admin panel and for Prometheus on the file server's /metrics.
+"""
+import os
+import json
+import math
+import time
+import threading
+
+import pipeline
+import jobs
+
+WINDOW = int(pipeline.get_config("METRICS_WINDOW", str(24 * 3600)))   # seconds of spans the aggregates cover
+MAX_READ = 16 << 20   # bytes read from the end of the log
+SUMMARY_TTL = int(pipeline.get_config("METRICS_TTL", "60"))   # seconds the admin panel and preflight reuse one summary
+_summary, _summary_lock = None, threading.Lock()
+
+
+def load_spans(since):
+    """Spans that ended after `since`, oldest first."""
+    out = []
+    for path in (pipeline.SPAN_LOG + ".1", pipeline.SPAN_LOG):
+        try:
+            with open(path, "rb") as f:
+                f.seek(max(0, os.path.getsize(path) - MAX_READ))
+                lines = f.read().splitlines()
+        except OSError:
+            continue
+        for line in lines:
+            try: rec = json.loads(line)
+            except ValueError: continue   # first line of a partial read, or a torn write
+            if isinstance(rec, dict) and rec.get("end", 0) >= since: out.append(rec)
+    return out
+
+def quantile(values, q):
+    """Nearest-rank quantile of a sorted list."""
+    return values[min(len(values) - 1, max(0, math.ceil(q * len(values)) - 1))] if values else 0.0
+
+def summary(window=WINDOW):
+    """{"stages": {stage: {count, errors, p50, p95, bytes}}, "videos_per_hour": float, "window": s}."""
+    now = time.time()
+    spans = load_spans(now - window)
+    by_stage = {}
+    for s in spans: by_stage.setdefault(s["stage"], []).append(s)
+    stages = {}
+    for name, ss in sorted(by_stage.items()):
+        durs = sorted(s.get("dur", 0) for s in ss)
+        stages[name] = {"count": len(ss), "errors": sum(1 for s in ss if not s.get("ok", True)),
+                        "p50": quantile(durs, 0.5), "p95": quantile(durs, 0.95), "sum": sum(durs),
+                        "bytes": sum(s.get("bytes") or 0 for s in ss)}
+    done = [s for s in by_stage.get("job", []) if s.get("ok")]
+    # Rate over the span actually observed, so a fresh server doesn't report a 24 h average.
+    hours = max(now - min((s["start"] for s in done), default=now), 3600) / 3600
+    return {"stages": stages, "videos_per_hour": len(done) / hours, "window": window}
+
+def cached_summary():
+    """summary() shared by every session, rebuilt at most once per SUMMARY_TTL: reading the log
+    takes up to a second, too slow for something every rerun shows."""
+    global _summary
+    with _summary_lock:
+        if not _summary or time.time() - _summary[1] >= SUMMARY_TTL: _summary = (summary(), time.time())
+        return _summary[0]
+
+def prometheus():
+    """Summary in the Prometheus text exposition format."""
+    s, lines = summary(), []
+    def metric(name, kind, help_, rows):
+        lines.extend([f"# HELP {name} {help_}", f"# TYPE {name} {kind}"])
+        lines.extend(f"{name}{labels} {value:g}" for labels, value in rows)
+    st = s["stages"].items()
+    metric("nblm_stage_seconds", "summary", f"Stage durations over the last {s['window']}s.",
+           [(f'{{stage="{k}",quantile="{q}"}}', v[f"p{int(q * 100)}"]) for k, v in st for q in (0.5, 0.95)])
+    lines.extend(f'nblm_stage_seconds_sum{{stage="{k}"}} {v["sum"]:g}' for k, v in st)
+    lines.extend(f'nblm_stage_seconds_count{{stage="{k}"}} {v["count"]}' for k, v in st)
+    metric("nblm_stage_errors", "gauge", "Failed spans per stage in the window.", [(f'{{stage="{k}"}}', v["errors"]) for k, v in st])
+    metric("nblm_stage_bytes", "gauge", "Bytes written or uploaded per stage in the window.", [(f'{{stage="{k}"}}', v["bytes"]) for k, v in st if v["bytes"]])
+    metric("nblm_videos_per_hour", "gauge", "Finished videos per hour over the window.", [("", s["videos_per_hour"])])
+    enc = pipeline.ENCODER.status()
+    metric("nblm_encode_cores", "gauge", "Encode core budget and cores in use in this process.", [('{state="budget"}', enc["cores"]), ('{state="used"}', enc["used"])])
+    metric("nblm_encodes", "gauge", "Encodes running and waiting for cores in this process.", [('{state="running"}', enc["running"]), ('{state="queued"}', enc["queued"])])
+    metric("nblm_jobs", "gauge", "Jobs in the store by status.", [(f'{{status="{k}"}}', v) for k, v in jobs.get_store().status_counts().items()])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,148 @@
+"""In-process notebooklm-py session.
+
+Every `notebooklm` CLI call pays interpreter startup, imports, a fresh read of
+storage_state.json and a new auth handshake. NlmSession keeps one authenticated
+NotebookLMClient open on a private asyncio loop and answers the subset of CLI
+commands the pipeline uses with the same (ok, stdout, stderr) contract as
+pipeline.run_nlm. Anything it can't handle returns None so the caller falls
+back to the subprocess path.
+"""
+import os
+import json
+import asyncio
+import threading
+
+
+class Unsupported(Exception):
+    """Command or library version not covered in-process; use the CLI instead."""
+
+
+OPTIONS = {"-n": "notebook", "--notebook": "notebook", "--style": "style", "-a": "artifact", "--artifact": "artifact", "--timeout": "timeout"}
+
+def parse_args(args):
+    """Split a CLI arg list into positionals, option values and bare flags."""
+    pos, opts, flags, i = [], {}, set(), 0
+    while i < len(args):
+        a = args[i]
+        if a in OPTIONS and i + 1 < len(args):
+            opts[OPTIONS[a]] = args[i + 1]; i += 2; continue
+        if a.startswith("-"): flags.add(a)
+        else: pos.append(a)
+        i += 1
+    return pos, opts, flags
+
+def api(obj, method, /, *args, **kw):
+    """Coroutine for obj.<method>(*args, **kw), or Unsupported when this notebooklm-py has no such
+    method or signature. Nothing has been sent yet at that point, so the CLI can safely take over;
+    errors from the call itself are real failures, since the CLI would repeat what already ran."""
+    try:
+        fn = obj
+        for name in method.split("."): fn = getattr(fn, name)
+        return fn(*args, **kw)
+    except (AttributeError, TypeError) as e:
+        raise Unsupported(f"{method}: {e}")
+
+
+class NlmSession:
+    def __init__(self, home):
+        self.storage = os.path.join(home, "storage_state.json")
+        self.loop = asyncio.new_event_loop()
+        self.ctx, self.client, self.storage_mtime = None, None, None
+        self.open_lock = asyncio.Lock()
+        threading.Thread(target=self.loop.run_forever, name="nlm-session", daemon=True).start()
+
+    def run(self, args, timeout=300):
+        """(ok, stdout, stderr) like run_nlm, or None when the CLI should handle this call."""
+        try:
+            fut = asyncio.run_coroutine_threadsafe(self._dispatch(list(args), timeout), self.loop)
+            return fut.result(timeout + 5)
+        except (Unsupported, ImportError):
+            return None
+        except TimeoutError:
+            fut.cancel(); return False, "", "Command timed out"
+        except Exception as e:
+            if type(e).__name__ == "AuthError": self.reset()
+            return False, "", str(e) or type(e).__name__
+
+    def reset(self):
+        """Drop the client; the next call reconnects with whatever storage_state.json holds then."""
+        asyncio.run_coroutine_threadsafe(self._close(), self.loop)
+
+    async def _close(self):
+        ctx, self.ctx, self.client = self.ctx, None, None
+        if ctx:
+            try: await ctx.__aexit__(None, None, None)
+            except Exception: pass
+
+    async def _get_client(self):
+        from notebooklm import NotebookLMClient
+        async with self.open_lock:
+            mtime = os.path.getmtime(self.storage) if os.path.exists(self.storage) else None
+            if self.client is not None and mtime != self.storage_mtime:
+                await self._close()  # auth was updated from the admin panel
+            if self.client is None:
+                if mtime is None: raise Unsupported("no storage_state.json")
+                ctx = api(NotebookLMClient, "from_storage", path=self.storage)
+                self.client = await ctx.__aenter__()
+                self.ctx, self.storage_mtime = ctx, mtime
+            return self.client
+
+    async def _dispatch(self, args, timeout):
+        pos, opts, flags = parse_args(args)
+        if pos == [] and flags == {"--version"}:
+            import notebooklm
+            return True, f"NotebookLM CLI, version {notebooklm.__version__}", ""
+        cmd = tuple(pos[:2])
+        if cmd[:1] == ("list",):
+            c = await self._get_client()
+            return True, "\n".join(f"{nb.id}  {nb.title}" for nb in await asyncio.wait_for(api(c, "notebooks.list"), timeout)), ""
+        if cmd[:1] == ("create",) and len(pos) == 2:
+            c = await self._get_client()
+            nb = await asyncio.wait_for(api(c, "notebooks.create", pos[1]), timeout)
+            return True, f"Created notebook: {nb.id}", ""
+        nb_id = opts.get("notebook")
+        if not nb_id: raise Unsupported("implicit notebook context")
+        if cmd == ("source", "add") and len(pos) == 3 and os.path.isfile(pos[2]):
+            c = await self._get_client()
+            src = await asyncio.wait_for(api(c, "sources.add_file", nb_id, pos[2]), timeout)
+            if "--json" in flags: return True, json.dumps({"source": {"id": src.id, "title": src.title}}), ""
+            return True, f"Added source: {src.id}", ""
+        if cmd == ("source", "wait") and len(pos) == 3:
+            c = await self._get_client()
+            await api(c, "sources.wait_until_ready", nb_id, pos[2], timeout=float(opts.get("timeout", 120)))
+            return True, f"Source ready: {pos[2]}", ""
+        if cmd == ("generate", "video") and len(pos) <= 3:
+            from notebooklm import VideoStyle
+            c = await self._get_client()
+            style = opts.get("style")
+            kw = {"instructions": pos[2] if len(pos) == 3 else None}
+            if style and style != "auto":
+                try: kw["video_style"] = VideoStyle[style.upper().replace("-", "_")]
+                except KeyError: raise Unsupported(f"style {style}")
+            status = await asyncio.wait_for(api(c, "artifacts.generate_video", nb_id, **kw), timeout)
+            if "--wait" in flags:
+                status = await c.artifacts.wait_for_completion(nb_id, status.task_id, timeout=timeout)
+                if status.status != "completed": return False, "", f"Generation {status.status}: {status.error or ''}".strip()
+            if "--json" in flags: return True, json.dumps({"task_id": status.task_id, "status": status.status}), ""
+            return True, f"Started: {status.task_id}", ""
+        if cmd == ("artifact", "poll") and len(pos) == 3:
+            c = await self._get_client()
+            status = await asyncio.wait_for(api(c, "artifacts.poll_status", nb_id, pos[2]), timeout)
+            return True, json.dumps({"task_id": status.task_id, "status": status.status, "url": status.url, "error": status.error}), ""
+        if cmd == ("download", "video") and len(pos) == 3:
+            c = await self._get_client()
+            path = await asyncio.wait_for(api(c, "artifacts.download_video", nb_id, pos[2], artifact_id=opts.get("artifact")), timeout)
+            return True, f"Downloaded: {path}", ""
+        raise Unsupported(" ".join(args))
+
+
+_sessions, _lock = {}, threading.Lock()
+
+def get_session(home):
+    """Process-wide session per NOTEBOOKLM_HOME (one per account); None if notebooklm-py can't be imported in-process."""
+    with _lock:
+        if home not in _sessions:
+            try: import notebooklm  # noqa: F401
+            except ImportError: return None
+            _sessions[home] = NlmSession(home)
+    return _sessions[home]
@@ -0,0 +1,641 @@
+"""NotebookLM + FFmpeg pipeline: everything needed to turn one PDF into a finished video.
+
+Kept free of Streamlit session state so it can run from the background job runner.
+"""
+import subprocess
+import os
+import re
+import shutil
+import json
+import time
+import hashlib
+import threading
+import contextvars
+from contextlib import contextmanager
+from fractions import Fraction
+from collections import OrderedDict, deque
+
+
+# ─── Config from env / secrets ───────────────────────────────────────────────
+def get_config(key, default=""):
+    """Get config from Streamlit secrets or environment variables."""
+    try:
+        import streamlit as st
+        return st.secrets.get(key, os.environ.get(key, default))
+    except:
+        return os.environ.get(key, default)
+
+NOTEBOOKLM_HOME = get_config("NOTEBOOKLM_HOME", "/tmp/notebooklm")
+NLM_BACKEND = get_config("NLM_BACKEND", "auto")          # "auto": in-process session with CLI fallback; "subprocess": CLI only
+DATA_DIR = get_config("DATA_DIR", "/tmp/nblm_data")      # jobs db + batch work dirs; mount a volume here
+MAX_WORKERS = int(get_config("MAX_WORKERS", "4"))        # PDFs processed in parallel (mostly waiting on NotebookLM)
+ENCODE_CORES = int(get_config("ENCODE_CORES", str(os.cpu_count() or 2)))   # CPU cores shared by all ffmpeg encodes
+MAX_ENCODES = int(get_config("MAX_ENCODES", "0"))        # extra cap on concurrent combines; 0: the core budget alone decides
+COMBINE_MODE = get_config("COMBINE_MODE", "concat")      # "concat": cached segments + remux; "filter": one ffmpeg, one encode
+SOURCE_TIMEOUT = int(get_config("SOURCE_TIMEOUT", "300"))       # max wait for NotebookLM to process an uploaded PDF
+GENERATE_TIMEOUT = int(get_config("GENERATE_TIMEOUT", "2400"))  # max wait for one video generation
+POLL_INTERVAL = float(get_config("POLL_INTERVAL", "15"))         # first generation status check; backs off x1.5 from there
+POLL_MAX_INTERVAL = 120.0
+PROBE_CACHE_SIZE = int(get_config("PROBE_CACHE_SIZE", "2048"))  # ffprobe results kept in memory, shared by all sessions
+SPAN_LOG_MB = int(get_config("SPAN_LOG_MB", "50"))               # timing log size before it is rotated to spans.jsonl.1
+
+# x264 preset/CRF and encoder threads per output height; the smallest row covering the target
+# height applies. Override with ENCODE_PROFILES as JSON in the same shape.
+ENCODE_PROFILES = get_config("ENCODE_PROFILES", "") or {
+    "720": {"preset": "fast", "crf": 23, "threads": 2},
+    "1080": {"preset": "fast", "crf": 23, "threads": 4},
+    "2160": {"preset": "faster", "crf": 24, "threads": 8},
+}
+if isinstance(ENCODE_PROFILES, str): ENCODE_PROFILES = json.loads(ENCODE_PROFILES)
+# Every normalized segment is encoded with the same settings (video_codec_args) so the
+# concat demuxer can join them with -c copy.
+AUDIO_CODEC_ARGS = ["-c:a","aac","-b:a","192k","-ar","48000","-ac","2"]
+SEGMENT_CACHE_DIR = os.path.join(DATA_DIR, "segments")
+PREVIEW_HEIGHT = int(get_config("PREVIEW_HEIGHT", "360"))   # height of review previews and posters; 0 = none
+PREVIEW_CODEC_ARGS = ["-c:v","libx264","-preset","veryfast","-crf","30","-maxrate","500k","-bufsize","1M","-pix_fmt","yuv420p",
+                      "-c:a","aac","-b:a","64k","-ac","2","-movflags","+faststart"]
+
+# ─── Timing Spans ────────────────────────────────────────────────────────────
+# One JSON line per stage (subprocess call, wait, download...) in DATA_DIR/spans.jsonl;
+# metrics.py aggregates them for /metrics and the admin panel.
+SPAN_LOG = os.path.join(DATA_DIR, "spans.jsonl")
+CURRENT_JOB = contextvars.ContextVar("current_job", default=None)   # set by the job runner around each job step
+_span_lock = threading.Lock()
+
+def log_span(rec):
+    rec.setdefault("job", CURRENT_JOB.get())
+    line = json.dumps({k: v for k, v in rec.items() if v is not None}, separators=(",", ":")) + "\n"
+    with _span_lock:
+        try:
+            if os.path.exists(SPAN_LOG) and os.path.getsize(SPAN_LOG) > SPAN_LOG_MB * 1024 * 1024:
+                os.replace(SPAN_LOG, SPAN_LOG + ".1")
+            with open(SPAN_LOG, "a") as f: f.write(line)
+        except OSError:
+            pass
+
+def log_interval(stage, start, end=None, ok=True, **fields):
+    """Record a span measured elsewhere, e.g. from timestamps kept in the job store."""
+    end = end or time.time()
+    log_span({"stage": stage, **fields, "start": start, "end": end, "dur": round(end - start, 3), "ok": ok})
+
+@contextmanager
+def span(stage, **fields):
+    """Time the block as one stage. It may set "ok", "exit", "bytes" or "error" on the yielded dict."""
+    rec = {"stage": stage, **fields, "start": time.time()}
+    try:
+        yield rec
+    except BaseException as e:
+        rec.setdefault("ok", False); rec.setdefault("error", str(e) or type(e).__name__)
+        raise
+    finally:
+        rec["end"] = time.time(); rec["dur"] = round(rec["end"] - rec["start"], 3)
+        rec.setdefault("ok", True)
+        log_span(rec)
+
+def file_bytes(path):
+    return os.path.getsize(path) if path and os.path.isfile(path) else None
+
+def run_cmd(cmd, stage, path=None, **kw):
+    """subprocess.run recorded as a span with its exit code and the size of `path`
+    (the file it wrote or uploaded), if given."""
+    with span(stage) as sp:
+        r = subprocess.run(cmd, **kw)
+        sp.update(ok=r.returncode == 0, exit=r.returncode, bytes=file_bytes(path))
+        return r
+
+# ─── NLM CLI Wrapper ─────────────────────────────────────────────────────────
+UUID_RE = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}', re.I)
+
+# Account in use: the job runner points this at the NOTEBOOKLM_HOME of the account a job runs on.
+NLM_HOME = contextvars.ContextVar("nlm_home", default=None)
+
+def current_home():
+    return NLM_HOME.get() or NOTEBOOKLM_HOME
+
+def get_nlm_env():
+    env = os.environ.copy()
+    env["NOTEBOOKLM_HOME"] = current_home()
+    return env
+
+def nlm_stage(args):
+    """Span name for a notebooklm command: "create", "source add", "download video"..."""
+    n = 2 if args and args[0] in ("source", "generate", "artifact", "download") else 1
+    return "nlm " + " ".join(args[:n])
+
+def run_nlm(args, timeout=300):
+    """Run a notebooklm command -> (ok, stdout, stderr). Served by the long-lived in-process
+    session when possible; the CLI subprocess handles everything else."""
+    if NLM_BACKEND != "subprocess":
+        import nlm_session
+        session = nlm_session.get_session(current_home())
+        if session:
+            with span(nlm_stage(args), backend="session") as sp:
+                res = session.run(args, timeout)
+                if res is not None: sp.update(ok=res[0], exit=0 if res[0] else 1, bytes=file_bytes(nlm_file(args)))
+                else: sp.update(stage=nlm_stage(args) + " (fallback)")
+            if res is not None: return res
+    return run_nlm_subprocess(args, timeout)
+
+def nlm_file(args):
+    """The file a source add uploads or a download writes, for span byte counts."""
+    return args[2] if len(args) > 2 and args[:2] in (["source", "add"], ["download", "video"]) else None
+
+def run_nlm_subprocess(args, timeout=300):
+    try:
+        r = run_cmd(["notebooklm"] + args, nlm_stage(args), nlm_file(args), capture_output=True, text=True, timeout=timeout, env=get_nlm_env())
+        return r.returncode == 0, r.stdout.strip(), r.stderr.strip()
+    except FileNotFoundError:
+        return False, "", "notebooklm-py not installed"
+    except subprocess.TimeoutExpired:
+        return False, "", "Command timed out"
+    except Exception as e:
+        return False, "", str(e)
+
+def check_installed():
+    ok, _, _ = run_nlm(["--version"], timeout=10); return ok
+
+def check_auth(home=None):
+    token = NLM_HOME.set(home) if home else None
+    try:
+        ok, _, _ = run_nlm(["list"], timeout=30); return ok
+    finally:
+        if token: NLM_HOME.reset(token)
+
+# ─── Video Helpers ───────────────────────────────────────────────────────────
+def batch_dir(batch_id):
+    p = os.path.join(DATA_DIR, "batches", batch_id)
+    os.makedirs(p, exist_ok=True)
+    return p
+
+class LRUCache:
+    """Small thread-safe LRU map. Module-level instances live as long as the process, so every
+    Streamlit session and background worker shares them."""
+
+    def __init__(self, maxsize):
+        self.maxsize, self.data, self.lock = maxsize, OrderedDict(), threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            if key not in self.data: return None
+            self.data.move_to_end(key); return self.data[key]
+
+    def put(self, key, value):
+        with self.lock:
+            self.data[key] = value; self.data.move_to_end(key)
+            while len(self.data) > self.maxsize: self.data.popitem(last=False)
+
+def file_key(path):
+    """(path, mtime, size) identity: any rewrite of the file invalidates cached results for it."""
+    st_ = os.stat(path)
+    return (path, st_.st_mtime_ns, st_.st_size)
+
+_probe_cache = LRUCache(PROBE_CACHE_SIZE)
+
+def parse_rate(s):
+    try: return float(Fraction(s)) if s and s != "0/0" else 0.0
+    except (ValueError, ZeroDivisionError): return 0.0
+
+def vid_info(path):
+    """ffprobe summary of a video. Cached on (path, mtime, size), so Streamlit reruns don't re-probe."""
+    try: key = file_key(path)
+    except (OSError, TypeError): key = None
+    hit = _probe_cache.get(key) if key else None
+    if hit: return dict(hit)
+    try:
+        r = run_cmd(["ffprobe","-v","quiet","-print_format","json","-show_format","-show_streams",path], "ffprobe", capture_output=True, text=True, timeout=30)
+        d = json.loads(r.stdout); dur = float(d.get("format",{}).get("duration",0))
+        vs = next((s for s in d.get("streams",[]) if s["codec_type"]=="video"), {})
+        au = next((s for s in d.get("streams",[]) if s["codec_type"]=="audio"), {})
+        fps = parse_rate(vs.get("r_frame_rate","0/1"))
+        info = {"duration":dur,"duration_str":f"{int(dur//60)}:{int(dur%60):02d}","width":int(vs.get("width",0)),"height":int(vs.get("height",0)),"fps":fps,"has_audio":bool(au),"size_mb":os.path.getsize(path)/(1024*1024),
+                "vcodec":vs.get("codec_name",""),"profile":vs.get("profile",""),"pix_fmt":vs.get("pix_fmt",""),"acodec":au.get("codec_name",""),"sample_rate":int(au.get("sample_rate",0) or 0),"channels":int(au.get("channels",0) or 0),
+                "vtime_base":vs.get("time_base",""),"atime_base":au.get("time_base","")}
+        _probe_cache.put(key, info)
+        return dict(info)
+    except:
+        # Failures are not cached: a timeout or a file still being written should be retried next time.
+        return {"duration":0,"duration_str":"0:00","width":0,"height":0,"fps":0,"has_audio":False,"size_mb":0,"vcodec":"","profile":"","pix_fmt":"","acodec":"","sample_rate":0,"channels":0,"vtime_base":"","atime_base":""}
+
+def stream_compatible(info, res, fps, ref=None):
+    """True when a file already has the streams normalize() would produce, so it can join the
+    concat list untouched. `ref` is a normalized segment whose H.264 profile and stream time bases
+    must also match: -c copy keeps each file's timestamps, so a different timescale corrupts them."""
+    w, h = (int(x) for x in res.split("x"))
+    return (info["vcodec"] == "h264" and info["pix_fmt"] == "yuv420p" and (info["width"], info["height"]) == (w, h)
+            and abs(info["fps"] - float(fps)) < 0.01 and info["acodec"] == "aac" and info["sample_rate"] == 48000
+            and info["channels"] == 2 and (ref is None or all(ref[k] == info[k] for k in ("profile", "vtime_base", "atime_base"))))
+
+_hash_cache, _segment_locks, _memo_lock = LRUCache(PROBE_CACHE_SIZE), {}, threading.Lock()
+
+def file_sha256(path):
+    """Content hash of a file, memoized on (path, mtime, size) so unchanged files are read once."""
+    k = file_key(path)
+    digest = _hash_cache.get(k)
+    if digest: return digest
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""): h.update(chunk)
+    _hash_cache.put(k, h.hexdigest())
+    return h.hexdigest()
+
+def sha256_stream(f, chunk=1 << 20):
+    """SHA-256 of a seekable file-like object, read in chunks; leaves it rewound."""
+    h = hashlib.sha256(); f.seek(0)
+    for b in iter(lambda: f.read(chunk), b""): h.update(b)
+    f.seek(0)
+    return h.hexdigest()
+
+def spool(f, dst, digest=None):
+    """Copy a file-like object (seekable or a stream) to dst in chunks, hashing on the way -> SHA-256. When `digest` is
+    given and dst already holds that content, nothing is written, so dst keeps its mtime and every
+    cache keyed on it (probe, hash, segments) stays warm."""
+    if digest and os.path.exists(dst) and file_sha256(dst) == digest: return digest
+    h, tmp, rewind = hashlib.sha256(), f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp", f.seekable()
+    if rewind: f.seek(0)
+    with open(tmp, "wb") as out:
+        for b in iter(lambda: f.read(1 << 20), b""): h.update(b); out.write(b)
+    if rewind: f.seek(0)
+    os.replace(tmp, dst)
+    _hash_cache.put(file_key(dst), h.hexdigest())   # downstream keys reuse it without re-reading
+    return h.hexdigest()
+
+# ─── Encode Scheduling ───────────────────────────────────────────────────────
+def encode_profile(res):
+    h = int(res.split("x")[1])
+    rows = sorted(ENCODE_PROFILES.items(), key=lambda kv: int(kv[0]))
+    return next((p for k, p in rows if int(k) >= h), rows[-1][1])
+
+ENCODE_THREADS = contextvars.ContextVar("encode_threads", default=None)   # set while holding an encode slot
+
+def video_codec_args(res, crf=None):
+    p = encode_profile(res)
+    return ["-c:v","libx264","-preset",str(p["preset"]),"-crf",str(crf if crf is not None else p["crf"]),"-pix_fmt","yuv420p"]
+
+def thread_args():
+    n = ENCODE_THREADS.get()
+    return ["-threads", str(n)] if n else []
+
+class EncodeScheduler:
+    """Admits encodes against a core budget shared by every session in the process, first come
+    first served. Each encode gets its profile's thread count (capped at the budget) as -threads,
+    so concurrent encodes fill the CPU without oversubscribing it."""
+
+    def __init__(self, cores, max_jobs=0):
+        self.cores, self.max_jobs = max(1, cores), max_jobs
+        self.used, self.running, self.queue = 0, 0, deque()
+        self.cond = threading.Condition()
+
+    @contextmanager
+    def slot(self, *res):
+        """Hold cores for one ffmpeg run encoding the given resolution(s); yields the core count."""
+        want, ticket = min(self.cores, max(1, sum(int(encode_profile(r).get("threads", 1)) for r in res))), object()
+        with self.cond:
+            self.queue.append(ticket)
+            while self.queue[0] is not ticket or self.used + want > self.cores or (self.max_jobs and self.running >= self.max_jobs):
+                self.cond.wait()
+            self.queue.popleft(); self.used += want; self.running += 1
+            self.cond.notify_all()
+        token = ENCODE_THREADS.set(want)
+        try:
+            yield want
+        finally:
+            ENCODE_THREADS.reset(token)
+            with self.cond:
+                self.used -= want; self.running -= 1
+                self.cond.notify_all()
+
+    def status(self):
+        with self.cond:
+            return {"cores": self.cores, "used": self.used, "running": self.running, "queued": len(self.queue)}
+
+ENCODER = EncodeScheduler(ENCODE_CORES, MAX_ENCODES)
+
+def normalize_cmd(src, dst, res, fps, has_audio):
+    w, h = res.split("x")
+    vf = f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2:black,fps={fps}"
+    if has_audio:
+        return ["ffmpeg","-y","-i",src,"-vf",vf,*video_codec_args(res),*thread_args(),*AUDIO_CODEC_ARGS,dst]
+    return ["ffmpeg","-y","-i",src,"-f","lavfi","-i","anullsrc=channel_layout=stereo:sample_rate=48000","-vf",vf,*video_codec_args(res),*thread_args(),*AUDIO_CODEC_ARGS,"-map","0:v:0","-map","1:a:0","-shortest",dst]
+
+def normalize(src, dst, res, fps):
+    r = run_cmd(normalize_cmd(src, dst, res, fps, vid_info(src).get("has_audio")), "ffmpeg normalize", dst, capture_output=True, text=True, timeout=600)
+    return r.returncode == 0
+
+def cached_segment(src, res, fps):
+    """Normalize an intro/outro once per (content, res, fps, codec settings) and reuse it across
+    items, batches and sessions. Returns the cached path, or None if ffmpeg failed."""
+    key = hashlib.sha256("|".join([file_sha256(src), res, str(fps), *video_codec_args(res), *AUDIO_CODEC_ARGS]).encode()).hexdigest()[:32]
+    dst = os.path.join(SEGMENT_CACHE_DIR, f"seg_{key}.mp4")
+    with _memo_lock: lock = _segment_locks.setdefault(key, threading.Lock())
+    with lock:
+        if os.path.exists(dst):
+            os.utime(dst)   # last use, for the janitor's LRU eviction
+            return dst
+        os.makedirs(SEGMENT_CACHE_DIR, exist_ok=True)
+        # Encode under a unique temp name and rename, so other processes never see a partial file.
+        tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp.mp4"
+        if not normalize(src, tmp, res, fps):
+            if os.path.exists(tmp): os.remove(tmp)
+            return None
+        os.replace(tmp, dst)
+        return dst
+
+def combine_videos(intro, main, outro, output, res="1920x1080", fps=30, wd=None, mode=None, poster_at=None, renditions=None):
+    """Join intro + main + outro into `output` at res/fps -> (ok, message). `mode` overrides COMBINE_MODE.
+    With `poster_at`, filter mode also writes the preview and poster in the same pass. With more
+    than one of `renditions` (the first being res/fps) every one is encoded from a single decode,
+    the extra ones next to `output` (see rendition_path)."""
+    ladder = renditions if renditions and len(renditions) > 1 else None
+    mode = "ladder" if ladder else mode or COMBINE_MODE
+    queued = time.time()
+    with ENCODER.slot(*([r["res"] for r in ladder] if ladder else [res])) as threads:
+        log_interval("encode wait", queued, threads=threads)
+        with span("combine", mode=mode, threads=threads) as sp:
+            if ladder: ok, msg = _combine_ladder(intro, main, outro, output, ladder, poster_at)
+            elif mode == "filter": ok, msg = _combine_filter(intro, main, outro, output, res, fps, poster_at)
+            else: ok, msg = _combine_videos(intro, main, outro, output, res, fps, wd or os.path.dirname(output))
+            outs = [output] + [rendition_path(output, r, ladder[0]["fps"]) for r in (ladder or [])[1:]]
+            sp.update(ok=ok, bytes=sum(file_bytes(o) or 0 for o in outs) if ok else None)
+            return ok, msg
+
+def combine_parts(intro, main, outro):
+    parts, labels = [], []
+    if intro and os.path.exists(intro): parts.append(intro); labels.append("intro")
+    if main and os.path.exists(main): parts.append(main); labels.append("main")
+    if outro and os.path.exists(outro): parts.append(outro); labels.append("outro")
+    return parts, labels
+
+def filter_concat_cmd(parts, output, res, fps, poster_at=None, renditions=None):
+    """One ffmpeg run: decode every part, scale/pad/fps it (silence where there is no audio),
+    concat in the filter graph and encode the result once. With `poster_at` the concatenated
+    stream is also forked into the preview and poster outputs, and every further rendition
+    (renditions[0] is res/fps itself) is split off, scaled and encoded in the same run. ValueError
+    when a part without audio has no known duration: its silence would never end."""
+    w, h = res.split("x")
+    cmd, inputs, graph, n = ["ffmpeg", "-y"], [], [], len(parts)
+    for p in parts: cmd += ["-i", p]
+    for i, p in enumerate(parts):
+        info = vid_info(p)
+        graph.append(f"[{i}:v]scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2:black,fps={fps},setsar=1,format=yuv420p[v{i}]")
+        if info["has_audio"]:
+            graph.append(f"[{i}:a]aresample=48000,aformat=sample_fmts=fltp:channel_layouts=stereo[a{i}]")
+        else:
+            if info["duration"] <= 0: raise ValueError(f"Can't read the duration of {os.path.basename(p)}")
+            cmd += ["-f", "lavfi", "-t", f"{info['duration']:.3f}", "-i", "anullsrc=channel_layout=stereo:sample_rate=48000"]
+            graph.append(f"[{n + len(inputs)}:a]aformat=sample_fmts=fltp:channel_layouts=stereo[a{i}]"); inputs.append(i)
+    proxies = poster_at is not None and PREVIEW_HEIGHT > 0
+    extra = (renditions or [])[1:]
+    graph.append("".join(f"[v{i}][a{i}]" for i in range(n)) + f"concat=n={n}:v=1:a=1[vc][ac]")
+    src = "vc"
+    if proxies: graph += proxy_filters("vc", poster_at, tee="vt"); src = "vt"
+    vs, as_ = [f"r{k}" for k in range(1 + len(extra))], [f"ra{k}" for k in range(1 + len(extra))] + (["pa"] if proxies else [])
+    graph.append(f"[{src}]split={len(vs)}{''.join(f'[{v}]' for v in vs)}" if len(vs) > 1 else f"[{src}]null[r0]")
+    graph.append(f"[ac]asplit={len(as_)}{''.join(f'[{a}]' for a in as_)}" if len(as_) > 1 else "[ac]anull[ra0]")
+    outs = [("r0", "ra0", res, renditions[0].get("crf") if renditions else None, output)]
+    for k, r in enumerate(extra, 1):
+        rw, rh = r["res"].split("x")
+        graph.append(f"[r{k}]scale={rw}:{rh}:force_original_aspect_ratio=decrease,pad={rw}:{rh}:(ow-iw)/2:(oh-ih)/2:black,fps={r['fps']},setsar=1[o{k}]")
+        outs.append((f"o{k}", f"ra{k}", r["res"], r.get("crf"), rendition_path(output, r, fps)))
+    cmd += ["-filter_complex", ";".join(graph)]
+    for v, a, r, crf, path in outs:
+        # One thread budget per encoder; a single output takes the whole encoder slot.
+        threads = thread_args() if not extra else ["-threads", str(encode_profile(r).get("threads", 1))]
+        cmd += ["-map", f"[{v}]", "-map", f"[{a}]", *video_codec_args(r, crf), *threads, *AUDIO_CODEC_ARGS, "-movflags", "+faststart", path]
+    return cmd + (proxy_outputs(output, "[pa]") if proxies else [])
+
+def _combine_filter(intro, main, outro, output, res, fps, poster_at=None):
+    parts, _ = combine_parts(intro, main, outro)
+    if not parts: return False, "No files"
+    if len(parts) == 1: shutil.copy2(parts[0], output); return True, "OK"
+    try: cmd = filter_concat_cmd(parts, output, res, fps, poster_at)
+    except ValueError: return _combine_videos(intro, main, outro, output, res, fps, os.path.dirname(output))   # normalize() pads with -shortest
+    r = run_cmd(cmd, "ffmpeg filter concat", output, capture_output=True, text=True, timeout=1200)
+    if r.returncode != 0: drop_proxies(output); return False, "FFmpeg error (filter concat)"
+    return True, "OK"
+
+def _combine_ladder(intro, main, outro, output, renditions, poster_at=None):
+    parts, _ = combine_parts(intro, main, outro)
+    if not parts: return False, "No files"
+    r0 = renditions[0]
+    try: cmd = filter_concat_cmd(parts, output, r0["res"], r0["fps"], poster_at, renditions)
+    except ValueError as e: return False, str(e)
+    r = run_cmd(cmd, "ffmpeg ladder", output, capture_output=True, text=True, timeout=1800)
+    if r.returncode != 0:
+        drop_proxies(output)
+        for p in [output] + [rendition_path(output, x, r0["fps"]) for x in renditions[1:]]:
+            if os.path.exists(p): os.remove(p)
+        return False, "FFmpeg error (ladder)"
+    return True, "OK"
+
+def _combine_videos(intro, main, outro, output, res, fps, wd):
+    parts, labels = combine_parts(intro, main, outro)
+    if not parts: return False, "No files"
+    if len(parts) == 1: shutil.copy2(parts[0], output); return True, "OK"
+    # Intro/outro are identical for every item: encode once, then reuse from the cache.
+    norm = [cached_segment(p, res, fps) if l != "main" else p for p, l in zip(parts, labels)]
+    for n, l in zip(norm, labels):
+        if not n: return False, f"FFmpeg error ({l})"
+    # Intermediates are named after the output (unique per item) and removed as soon as the concat is done.
+    stem, temps = os.path.splitext(os.path.basename(output))[0], []
+    try:
+        if "main" in labels:
+            i = labels.index("main")
+            ref = vid_info(norm[1] if i == 0 else norm[0])
+            # A main video already in the target format is remuxed with -c copy instead of re-encoded.
+            if not stream_compatible(vid_info(main), res, fps, ref):
+                n = os.path.join(wd, f"norm_main_{stem}.mp4"); temps.append(n)
+                if not normalize(main, n, res, fps): return False, "FFmpeg error (main)"
+                norm[i] = n
+        cf = os.path.join(wd, f"concat_{stem}.txt"); temps.append(cf)
+        with open(cf, "w") as f:
+            for p in norm: f.write(f"file '{p}'\n")
+        r = run_cmd(["ffmpeg","-y","-f","concat","-safe","0","-i",cf,"-c","copy",output], "ffmpeg concat", output, capture_output=True, text=True, timeout=600)
+        if r.returncode != 0: return False, "Concat error"
+        return True, "OK"
+    finally:
+        for t in temps:
+            if os.path.exists(t): os.remove(t)
+
+# ─── Renditions ──────────────────────────────────────────────────────────────
+# A batch can ask for several outputs per video ({"res", "fps", "crf"} each, highest first). The
+# first is the job's `output`; the rest sit next to it, named after their label.
+def rendition_label(r, base_fps):
+    return f"{r['res'].split('x')[1]}p" + (str(r["fps"]) if int(r["fps"]) != int(base_fps) else "")
+
+def rendition_path(output, r, base_fps):
+    return f"{os.path.splitext(output)[0]}.{rendition_label(r, base_fps)}.mp4"
+
+# ─── Preview Proxies ─────────────────────────────────────────────────────────
+# A poster JPEG and a small low-bitrate MP4 next to every finished video, so reviewing a batch
+# doesn't stream full-resolution files. Filter mode writes them from its own decode; otherwise
+# they take one extra decode of the finished file.
+def preview_path(video):
+    return os.path.splitext(video)[0] + ".preview.mp4"
+
+def poster_path(video):
+    return os.path.splitext(video)[0] + ".poster.jpg"
+
+def proxy_paths(video):
+    return preview_path(video), poster_path(video)
+
+def has_proxies(video):
+    return all(os.path.exists(p) and os.path.getsize(p) > 0 for p in proxy_paths(video))
+
+def drop_proxies(video):
+    for p in proxy_paths(video):
+        if os.path.exists(p): os.remove(p)
+
+def poster_time(intro, main):
+    """A frame a little into the main part: the intro's first frame would be the same for every video."""
+    intro_d = vid_info(intro).get("duration", 0) if intro and os.path.exists(intro) else 0
+    return intro_d + min(10, vid_info(main).get("duration", 0) / 4)
+
+def proxy_filters(src, poster_at, tee=None):
+    """Graph lines turning video label `src` into a preview [pv] and a poster frame [ps] taken at
+    `poster_at` seconds. With `tee` the untouched stream is passed on under that label too."""
+    outs = ([f"[{tee}]"] if tee else []) + ["[pvs]", "[pss]"]
+    return [f"[{src}]split={len(outs)}{''.join(outs)}",
+            f"[pvs]scale=-2:{PREVIEW_HEIGHT}[pv]",
+            f"[pss]trim=start={poster_at:.3f},setpts=PTS-STARTPTS,scale=-2:{PREVIEW_HEIGHT}[ps]"]
+
+def proxy_outputs(video, audio):
+    """Output options writing [pv] (+ `audio`) to the preview and [ps] to the poster of `video`."""
+    preview, poster = proxy_paths(video)
+    return ["-map", "[pv]", "-map", audio, *PREVIEW_CODEC_ARGS, *thread_args(), preview,
+            "-map", "[ps]", "-frames:v", "1", "-q:v", "3", poster]
+
+def proxies_cmd(video, poster_at):
+    return ["ffmpeg", "-y", "-i", video, "-filter_complex", ";".join(proxy_filters("0:v", poster_at)), *proxy_outputs(video, "0:a?")]
+
+def make_proxies(video, poster_at):
+    """Poster and preview for a finished video -> ok. Best effort: the video itself is done either way."""
+    if not PREVIEW_HEIGHT: return False
+    with ENCODER.slot(f"{PREVIEW_HEIGHT * 16 // 9}x{PREVIEW_HEIGHT}"):
+        r = run_cmd(proxies_cmd(video, poster_at), "ffmpeg proxies", preview_path(video), capture_output=True, text=True, timeout=600)
+    if r.returncode != 0 or not has_proxies(video): drop_proxies(video); return False
+    return True
+
+# ─── PDF → Video ─────────────────────────────────────────────────────────────
+VIDEO_STYLES = ["classic", "whiteboard", "watercolor", "retro-print", "heritage", "paper-craft", "kawaii", "anime", "auto"]
+
+# Split in phases so a batch can start every generation first and then wait on all of them
+# together (see jobs.JobRunner); process_single_pdf chains them for a single PDF.
+
+def run_nlm_json(args, timeout=300):
+    """run_nlm with --json; returns (ok, parsed dict or {}, stderr)."""
+    ok, out, err = run_nlm(args + ["--json"], timeout=timeout)
+    try: data = json.loads(out) if out else {}
+    except ValueError: data = {}
+    return ok, data if isinstance(data, dict) else {}, err or (out if not ok else "")
+
+def safe_stem(pdf_name):
+    return re.sub(r'[^\w\-.]', '_', pdf_name.replace('.pdf', ''))
+
+def raw_path(wd, pdf_name):
+    return os.path.join(wd, f"raw_{safe_stem(pdf_name)}.mp4")
+
+def final_path(wd, pdf_name):
+    return os.path.join(wd, f"final_{safe_stem(pdf_name)}.mp4")
+
+def start_generation(pdf_path, pdf_name, style, prompt, status_cb, nb_id=None, on_nb_id=None):
+    """Create the notebook, upload the PDF, wait until the source is processed and kick off
+    generation without waiting for it. Returns (ok, (nb_id, task_id), error). With `nb_id`
+    (a resumed job) the notebook and its source are reused."""
+    if not nb_id:
+        status_cb("Creating notebook...")
+        title = pdf_name.replace(".pdf", "").replace("_", " ").title()
+        ok, out, err = run_nlm(["create", title], timeout=60)
+        m = UUID_RE.search(out + "\n" + err)
+        if not m: return False, None, f"Create failed: {err}"
+        nb_id = m.group(0)
+
+        # Every call names its notebook explicitly: `use` sets a shared context that
+        # parallel workers would overwrite under each other.
+        status_cb("Uploading PDF...")
+        ok, data, err = run_nlm_json(["source", "add", pdf_path, "-n", nb_id], timeout=180)
+        if not ok: return False, None, f"Source add: {err}"
+        if on_nb_id: on_nb_id(nb_id)
+
+        # Wait on the source's real status instead of guessing with a fixed sleep.
+        src_id = (data.get("source") or {}).get("id")
+        if src_id:
+            status_cb("Waiting for processing...")
+            ok, _, err = run_nlm(["source", "wait", src_id, "-n", nb_id, "--timeout", str(SOURCE_TIMEOUT)], timeout=SOURCE_TIMEOUT + 30)
+            if not ok: return False, None, f"Source processing: {err or 'timed out'}"
+        else:
+            time.sleep(5)
+
+    status_cb("Starting video generation...")
+    cmd = ["generate", "video", "--no-wait", "-n", nb_id]
+    if style and style != "auto": cmd.extend(["--style", style])
+    if prompt: cmd.append(prompt)
+    ok, data, err = run_nlm_json(cmd, timeout=120)
+    if not ok or not data.get("task_id"): return False, None, f"Generate: {err or 'no task id returned'}"
+    return True, (nb_id, data["task_id"]), ""
+
+def poll_generation(nb_id, task_id):
+    """One non-blocking status check -> (status, error). Status is NotebookLM's
+    pending/in_progress/completed/failed/not_found, or "unknown" if the check itself failed."""
+    ok, data, err = run_nlm_json(["artifact", "poll", task_id, "-n", nb_id], timeout=60)
+    if not ok or not data.get("status"): return "unknown", err
+    return str(data["status"]), data.get("error") or ""
+
+def wait_generation(nb_id, task_id, timeout=None, interval=None):
+    """Block on one generation with backoff -> (ok, error). The job runner polls all jobs
+    together instead; this is for running a single PDF on its own."""
+    deadline, interval = time.time() + (timeout or GENERATE_TIMEOUT), interval or POLL_INTERVAL
+    while time.time() < deadline:
+        status, err = poll_generation(nb_id, task_id)
+        if status == "completed": return True, ""
+        if status == "failed": return False, err or "generation failed"
+        time.sleep(interval); interval = min(interval * 1.5, POLL_MAX_INTERVAL)
+    return False, "timed out"
+
+def download_video(nb_id, raw, task_id=None):
+    """Download the generated video -> (ok, error). Without `task_id` the notebook's latest video is used."""
+    # Download into a temp name so an interrupted download is never mistaken for a finished one.
+    part = raw + ".part.mp4"
+    cmd = ["download", "video", part, "-n", nb_id, "--force"]
+    if task_id: cmd.extend(["-a", task_id])
+    ok, out, err = run_nlm(cmd, timeout=300)
+    if not ok or not os.path.exists(part): return False, err or "no file"
+    os.replace(part, raw)
+    return True, ""
+
+def finish_video(pdf_name, nb_id, task_id, intro_path, outro_path, res, fps, status_cb, wd, renditions=None):
+    """Download (unless already on disk) and add intro/outro -> (ok, output path, error). With more
+    than one rendition the video is always re-encoded, into all of them at once."""
+    raw = raw_path(wd, pdf_name)
+    if not os.path.exists(raw):
+        status_cb("Downloading video...")
+        ok, err = download_video(nb_id, raw, task_id)
+        if not ok: return False, None, f"Download: {err}"
+
+    out, ladder = raw, renditions and len(renditions) > 1
+    if intro_path or outro_path or ladder:
+        status_cb(f"Encoding {len(renditions)} renditions..." if ladder else "Adding intro/outro...")
+        out = final_path(wd, pdf_name)
+        drop_proxies(out)   # left from an earlier run with other settings
+        ok, msg = combine_videos(intro_path, raw, outro_path, out, res, fps, wd, poster_at=poster_time(intro_path, raw), renditions=renditions)
+        if not ok: return False, None, f"Combine: {msg}"
+    if PREVIEW_HEIGHT and not has_proxies(out):
+        status_cb("Making preview...")
+        make_proxies(out, poster_time(intro_path, raw))
+    return True, out, ""
+
+def process_single_pdf(pdf_path, pdf_name, intro_path, outro_path, style, prompt, res, fps, status_cb, wd, nb_id=None, on_nb_id=None):
+    """Run one PDF end to end. Passing the `nb_id` of an earlier, interrupted run resumes
+    at the generate/download step instead of creating a new notebook."""
+    raw, task_id = raw_path(wd, pdf_name), None
+    if nb_id and not os.path.exists(raw):
+        # A resumed notebook may already hold the finished video from before the restart.
+        status_cb("Resuming notebook...")
+        download_video(nb_id, raw)
+    if not os.path.exists(raw):
+        ok, ids, err = start_generation(pdf_path, pdf_name, style, prompt, status_cb, nb_id, on_nb_id)
+        if not ok: return False, None, err
+        nb_id, task_id = ids
+        status_cb("Generating video (3-10 min)...")
+        ok, err = wait_generation(nb_id, task_id)
+        if not ok: return False, None, f"Generate: {err}"
+    return finish_video(pdf_name, nb_id, task_id, intro_path, outro_path, res, fps, status_cb, wd)
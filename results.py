@@ -0,0 +1,129 @@
+"""Persistent result cache for generated videos.
+
+Generating a video on NotebookLM is the slowest and quota-limited step, so
+every finished video is kept under DATA_DIR/results keyed by what produced it:
+the SHA-256 of the PDF plus style and prompt for the raw NotebookLM video, and
+that plus intro/outro content, resolution and fps for the final cut. A PDF that
+comes back under any name, in any batch, reuses the stored MP4s (hardlinked,
+no copy) and its notebook. Least recently used entries go once the cache
+outgrows RESULT_CACHE_MB.
+"""
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+
+import pipeline
+
+RESULTS_DIR = os.path.join(pipeline.DATA_DIR, "results")
+RESULT_CACHE_MB = int(pipeline.get_config("RESULT_CACHE_MB", "20480"))   # 0 disables the cache
+VIDEO = "video.mp4"
+
+
+def link_or_copy(src, dst):
+    """Hardlink src to dst (same volume, no extra space), else copy. Replaces dst atomically."""
+    # rename() onto another link of the same file is a no-op that would leave tmp behind.
+    if os.path.exists(dst) and os.path.samefile(src, dst): return
+    tmp = f"{dst}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try: os.link(src, tmp)
+    except OSError: shutil.copyfile(src, tmp)
+    os.replace(tmp, dst)
+
+def link_video(src, dst, renditions=None):
+    """link_or_copy a video together with its preview and poster, if it has them, and the further
+    renditions of a multi-rendition output."""
+    link_or_copy(src, dst)
+    extra = [(pipeline.rendition_path(src, r, renditions[0]["fps"]), pipeline.rendition_path(dst, r, renditions[0]["fps"])) for r in (renditions or [])[1:]]
+    for s, d in list(zip(pipeline.proxy_paths(src), pipeline.proxy_paths(dst))) + extra:
+        if os.path.exists(s): link_or_copy(s, d)
+        elif os.path.exists(d): os.remove(d)
+
+
+def gen_key(pdf_path, style, prompt):
+    """Identity of a raw NotebookLM video."""
+    parts = [pipeline.file_sha256(pdf_path), style or "", prompt or ""]
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+def final_key(gkey, intro, outro, res, fps, renditions=None):
+    """Identity of a finished video; None when the raw video is the result (no intro/outro, one rendition)."""
+    if not (intro or outro or renditions): return None
+    parts = [gkey, pipeline.file_sha256(intro) if intro else "", pipeline.file_sha256(outro) if outro else "", res, str(fps)]
+    if renditions: parts.append(renditions)
+    return hashlib.sha256(json.dumps(parts).encode()).hexdigest()
+
+
+class ResultCache:
+    def __init__(self, root=RESULTS_DIR, max_mb=RESULT_CACHE_MB):
+        self.root, self.max_bytes = root, max_mb * 1024 * 1024
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    @property
+    def enabled(self):
+        return self.max_bytes > 0
+
+    def _dir(self, key):
+        return os.path.join(self.root, key)
+
+    def get(self, key):
+        """(video path, meta) for a cached result, or None. A hit counts as a use for eviction."""
+        if not key or not self.enabled: return None
+        d = self._dir(key)
+        try:
+            with open(os.path.join(d, "meta.json")) as f: meta = json.load(f)
+        except (OSError, ValueError): return None
+        path = os.path.join(d, VIDEO)
+        if not os.path.exists(path): return None
+        os.utime(os.path.join(d, "meta.json"))
+        return path, meta
+
+    def put(self, key, src, renditions=None, **meta):
+        """Store a finished video (and its renditions) under key. meta.json is written last, so a
+        half-written entry is never a hit."""
+        if not key or not self.enabled or not os.path.exists(src): return
+        d = self._dir(key)
+        os.makedirs(d, exist_ok=True)
+        link_video(src, os.path.join(d, VIDEO), renditions)
+        with open(os.path.join(d, "meta.json.tmp"), "w") as f: json.dump({**meta, "stored": time.time()}, f)
+        os.replace(os.path.join(d, "meta.json.tmp"), os.path.join(d, "meta.json"))
+        self.evict()
+
+    def entries(self):
+        """[(key, bytes, last used)] for every complete entry."""
+        out = []
+        for key in os.listdir(self.root) if os.path.isdir(self.root) else []:
+            d = self._dir(key)
+            try:
+                out.append((key, os.path.getsize(os.path.join(d, VIDEO)), os.path.getmtime(os.path.join(d, "meta.json"))))
+            except OSError:
+                continue
+        return out
+
+    def usage(self):
+        """(entries, bytes) currently held."""
+        e = self.entries()
+        return len(e), sum(s for _, s, _ in e)
+
+    def evict(self):
+        """Drop least recently used entries until the cache fits its size limit."""
+        with self.lock:
+            e = sorted(self.entries(), key=lambda x: x[2])
+            total = sum(s for _, s, _ in e)
+            while e and total > self.max_bytes:
+                key, size, _ = e.pop(0)
+                shutil.rmtree(self._dir(key), ignore_errors=True); total -= size
+
+    def clear(self):
+        with self.lock:
+            for key in os.listdir(self.root): shutil.rmtree(self._dir(key), ignore_errors=True)
+
+
+_cache, _lock = None, threading.Lock()
+
+def get_cache():
+    global _cache
+    with _lock:
+        if _cache is None: _cache = ResultCache()
+    return _cache
@@ -0,0 +1,130 @@
+"""Headless entry point: the web UI's job store and runner, without Streamlit.
+
+    python -m studio batch ./pdfs --style whiteboard --res 1280x720 --jobs 4 --out ./videos
+    python -m studio batch a.pdf b.pdf --intro intro.mp4 --batch lms-nightly   # rerun to resume
+    python -m studio batch ./pdfs --res 1920x1080,1280x720 --out ./videos      # LMS + mobile
+    python -m studio status lms-nightly
+    python -m studio serve      # job runner + file server with the HTTP API (set API_TOKEN)
+
+Batches go into the same DATA_DIR job store as the UI's, so they survive a
+crash (rerun with the same --batch to pick up where it stopped) and can be
+watched from the browser at ?batch=<id>.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import argparse
+
+import pipeline
+import jobs
+import health
+import accounts
+import fileserver
+
+ICONS = {"pending": "⏳", "processing": "🔄", "done": "✅", "error": "❌"}
+
+
+def pdf_paths(paths):
+    """PDFs named on the command line; directories contribute the *.pdf files directly inside them."""
+    out = []
+    for p in paths:
+        if os.path.isdir(p): out += sorted(os.path.join(p, f) for f in os.listdir(p) if f.lower().endswith(".pdf"))
+        elif os.path.isfile(p): out.append(p)
+        else: sys.exit(f"❌ Not found: {p}")
+    return out
+
+def wait(store, batch):
+    """Print state changes until nothing in the batch is pending or processing -> final rows."""
+    seen = {}
+    while True:
+        items = store.list(batch)
+        for i in items:
+            line = f"{ICONS.get(i['status'], '?')} {i['name']}: {i['error'] or i['stage'] or i['status']}"
+            if seen.get(i["id"]) != line: seen[i["id"]] = line; print(line, flush=True)
+        if not any(i["status"] == "processing" or (i["status"] == "pending" and i["submitted"]) for i in items): return items
+        time.sleep(2)
+
+def cmd_batch(args):
+    accounts.load_env()
+    store, batch = jobs.get_store(), args.batch or f"cli-{uuid.uuid4().hex[:8]}"
+    pdfs = pdf_paths(args.paths)
+    if not pdfs: sys.exit("❌ No PDFs given")
+    added = 0
+    for p in pdfs:
+        with open(p, "rb") as f:
+            if jobs.queue_pdf(store, batch, os.path.basename(p), f): added += 1
+    try:
+        ladder = [{"res": r.strip()} for r in args.res.split(",")]
+        opts = jobs.make_opts(*(os.path.abspath(p) if p else None for p in (args.intro, args.outro)),
+                              args.style, args.prompt, ladder[0]["res"], args.fps, args.jobs, ladder if len(ladder) > 1 else None)
+    except ValueError as e:
+        sys.exit(f"❌ {e}")
+    pending = sum(1 for i in store.list(batch) if i["status"] == "pending" and not i["submitted"])
+    print(f"📂 Batch {batch}: {added} new PDF(s), {pending} to process", flush=True)
+
+    if pending:
+        if not health.installed(): sys.exit("❌ notebooklm-py is not installed")
+        allowed, warning = health.preflight(pending)
+        if not allowed and not args.force: sys.exit(f"❌ {warning} (--force to submit anyway)")
+        if warning: print(f"⚠️ {warning}", file=sys.stderr)
+        store.submit(batch, opts)
+    if args.no_wait: return
+
+    if jobs.JOB_RUNNER == "inprocess":
+        jobs.JobRunner(store, max_workers=max(pipeline.MAX_WORKERS, args.jobs), batch=batch)
+    try:
+        items = wait(store, batch)
+    except KeyboardInterrupt:
+        sys.exit(f"\n⏸️ Stopped. Jobs keep their state; rerun with --batch {batch} to resume.")
+
+    done = [i for i in items if i["status"] == "done" and i["output"] and os.path.exists(i["output"])]
+    if args.out:
+        os.makedirs(args.out, exist_ok=True)
+        for i in done:
+            # Real copies: a hardlink would pin the result cache against the quota and let edits reach it.
+            for _, path, name in jobs.outputs(i): shutil.copyfile(path, os.path.join(args.out, name))
+    failed = [i for i in items if i["status"] == "error"]
+    print(f"🏁 {len(done)} done, {len(failed)} failed" + (f" → {os.path.abspath(args.out)}" if args.out and done else ""))
+    if failed: sys.exit(1)
+
+def cmd_status(args):
+    rows = jobs.get_store().list(args.batch)
+    if not rows: sys.exit(f"❌ No batch {args.batch}")
+    print(json.dumps([{k: i[k] for k in ("id", "name", "status", "stage", "error", "output", "account")} for i in rows], indent=2))
+
+def cmd_serve(args):
+    accounts.load_env()
+    if not fileserver.start(): sys.exit(f"❌ Could not bind port {fileserver.FILES_PORT}")
+    jobs.get_runner()
+    print(f"🎬 Serving on :{fileserver.FILES_PORT}" + (" with /api/" if fileserver.API_TOKEN else " (set API_TOKEN to enable /api/)")
+          + ("" if jobs.JOB_RUNNER == "inprocess" else "; jobs run in the external runner"), flush=True)
+    while True: time.sleep(3600)
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(prog="python -m studio", description=__doc__.split("\n\n")[0])
+    sub = ap.add_subparsers(dest="cmd", required=True)
+    b = sub.add_parser("batch", help="queue PDFs, process them and wait")
+    b.add_argument("paths", nargs="+", help="PDF files and/or directories of PDFs")
+    b.add_argument("--style", default="auto", choices=pipeline.VIDEO_STYLES)
+    b.add_argument("--prompt", default="Create a comprehensive video overview of all major topics. Use clear explanations with timelines and diagrams. End with key takeaways.")
+    b.add_argument("--res", default="1920x1080", help="one or more, e.g. 1920x1080,1280x720: every video in each, from one encode")
+    b.add_argument("--fps", type=int, default=30)
+    b.add_argument("--intro"); b.add_argument("--outro")
+    b.add_argument("--jobs", type=int, default=3, help="PDFs uploaded or encoded at the same time")
+    b.add_argument("--batch", help="batch id; reuse one to resume or extend it")
+    b.add_argument("--out", help="copy finished videos here")
+    b.add_argument("--no-wait", action="store_true", help="submit and exit; another runner does the work")
+    b.add_argument("--force", action="store_true", help="submit even if the session is predicted to expire first")
+    s = sub.add_parser("status", help="print a batch's jobs as JSON")
+    s.add_argument("batch")
+    sub.add_parser("serve", help="run the job runner and the file server / HTTP API")
+    args = ap.parse_args(argv)
+    {"batch": cmd_batch, "status": cmd_status, "serve": cmd_serve}[args.cmd](args)
+
+
+if __name__ == "__main__":
+    main()